@@ -1,331 +1,584 @@
+import json
+from array import array
+
+import numpy as np
 import pandas as pd
 from ortools.sat.python import cp_model
 
+from cache import canonical_problem, fingerprint
+from export import COLUMNS, PERIODS, WEEKDAYS, check_formats, course_key, export_timetable, table_courses
+from feasibility import check_feasibility
+from rules import (DEFAULT_RULES, HARD_RULES, SOFT_RULES, add_at_most_one, allowed_slots,
+                   check_rules, enabled_rules, soft_weights, time_grid, with_symmetry_breaking)
+from telemetry import SolveMonitor, Telemetry
+
+
+class ModelIndex:
+    """决策变量的整数编码索引
+
+    教师、班级、课程编码为整数，变量按各约束族需要的维度预先分组，
+    建模时一次构建，所有约束族直接复用这些列表。
+    """
+    # 省内存模式见 CompactIndex
+    compact = False
+
+    def __init__(self, teacher_list, class_list, subject_list, days=6, periods=9):
+        self.teacher_list = teacher_list
+        self.class_list = class_list
+        self.subject_list = subject_list
+        self.days = days
+        self.periods = periods
+        self.teacher_code = {teacher: i for i, teacher in enumerate(teacher_list)}
+        self.class_code = {class_: i for i, class_ in enumerate(class_list)}
+        self.subject_code = {subject: i for i, subject in enumerate(subject_list)}
+
+        # 按名称索引的决策变量：(teacher, class, day, period, subject) -> BoolVar
+        self.x = {}
+        # 按整数编码排列的决策变量：keys[i] = (teacher, class, day, period, subject)，vars[i] 为对应变量
+        self.keys = []
+        self.vars = []
+        # (class, day, period) -> 变量列表
+        self.class_slot = [[[[] for _ in range(periods)] for _ in range(days)] for _ in class_list]
+        # (teacher, day, period) -> 变量列表
+        self.teacher_slot = [[[[] for _ in range(periods)] for _ in range(days)] for _ in teacher_list]
+        # (class, subject) -> 变量列表
+        self.class_subject = [[[] for _ in subject_list] for _ in class_list]
+        # (class, subject, day) -> 变量列表
+        self.class_subject_day = [[[[] for _ in range(days)] for _ in subject_list] for _ in class_list]
+        # (teacher, class, subject, day) -> 按课时排列的变量，不可排课的课时为 None
+        self.lesson_day = {}
+        # 假设文字及其说明，只在 build_model(assumptions=True) 时使用
+        self.assumptions = []
+        self._key_array = None
+        self._var_array = None
+
+    def add(self, teacher, class_, day, period, subject, var):
+        t = self.teacher_code[teacher]
+        c = self.class_code[class_]
+        s = self.subject_code[subject]
+        self.x[teacher, class_, day, period, subject] = var
+        self.keys.append((t, c, day, period, s))
+        self.vars.append(var)
+        self.class_slot[c][day][period].append(var)
+        self.teacher_slot[t][day][period].append(var)
+        self.class_subject[c][s].append(var)
+        self.class_subject_day[c][s][day].append(var)
+        lessons = self.lesson_day.get((t, c, s, day))
+        if lessons is None:
+            lessons = self.lesson_day[t, c, s, day] = [None] * self.periods
+        lessons[period] = var
+
+    def add_slots(self, model, teacher, class_, subject, slots):
+        """为教师在班级的一门课程在 slots 中的每个 (day, period) 创建决策变量"""
+        for day, period in slots:
+            self.add(teacher, class_, day, period, subject, model.NewBoolVar(
+                f"x[{teacher}, {class_}, {day}, {period}, {subject}]"
+            ))
+
+    def var_name(self, name):
+        """辅助变量的名称"""
+        return name
+
+    def release(self):
+        """一个约束族建完后释放中间结果；分组列表在整个建模过程中复用，不需要释放"""
+
+    def key_array(self):
+        """keys 的 NumPy 数组（变量数 × 5，int32），用于批量解析求解结果"""
+        if self._key_array is None or len(self._key_array) != len(self.keys):
+            self._key_array = np.array(self.keys, dtype=np.int32).reshape(-1, 5)
+        return self._key_array
+
+    def values(self, solver):
+        """全部决策变量的取值，布尔数组，与 key_array() 的行对应；solver 为求解后的 CpSolver 或求解回调"""
+        if self._var_array is None or len(self._var_array) != len(self.vars):
+            self._var_array = np.array([var.Index() for var in self.vars], dtype=np.int32)
+        return np.asarray(solver.response_proto.solution)[self._var_array].astype(bool)
+
+
+class _Groups:
+    """CompactIndex 的分组视图：按 shape 逐层取下标，取到最后一层时才创建该组变量的句柄列表"""
+
+    def __init__(self, index, order, offsets, shape, base=0):
+        self.index = index
+        self.order = order
+        self.offsets = offsets
+        self.shape = shape
+        self.base = base
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.shape[0]:
+            raise IndexError(i)
+        group = self.base * self.shape[0] + i
+        if len(self.shape) == 1:
+            return self.index.handles(self.order[self.offsets[group]:self.offsets[group + 1]])
+        return _Groups(self.index, self.order, self.offsets, self.shape[1:], group)
+
+    def __iter__(self):
+        for i in range(self.shape[0]):
+            yield self[i]
+
+
+class _LessonDays:
+    """CompactIndex.lesson_day 的视图：(teacher, class, subject, day) -> 按课时排列的变量，不可排课的课时为 None"""
+
+    def __init__(self, index):
+        self.index = index
+        keys = index.key_array()
+        t, c, day, s = (keys[:, column].astype(np.int64) for column in (0, 1, 2, 4))
+        codes = ((t * len(index.class_list) + c) * len(index.subject_list) + s) * index.days + day
+        self.order = np.argsort(codes, kind='stable').astype(np.int32)
+        codes = codes[self.order]
+        self.starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]).astype(np.int32)
+        self.ends = np.r_[self.starts[1:], len(codes)].astype(np.int32)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        keys = self.index.key_array()
+        for start in self.starts.tolist():
+            t, c, day, period, s = keys[self.order[start]].tolist()
+            yield t, c, s, day
+
+    def items(self):
+        keys = self.index.key_array()
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            positions = self.order[start:end]
+            t, c, day, period, s = keys[positions[0]].tolist()
+            lessons = [None] * self.index.periods
+            for period, var in zip(keys[positions, 3].tolist(), self.index.handles(positions)):
+                lessons[period] = var
+            yield (t, c, s, day), lessons
+
+
+class _KeyLookup:
+    """CompactIndex.x 的视图：按 (teacher, class, day, period, subject) 查找决策变量，第一次查找时才排序编码"""
+
+    def __init__(self, index):
+        self.index = index
+        self.order = None
+        self.codes = None
+
+    def _sort(self):
+        keys = self.index.key_array()
+        codes = self._code(*(keys[:, column].astype(np.int64) for column in range(5)))
+        self.order = np.argsort(codes, kind='stable').astype(np.int32)
+        self.codes = codes[self.order]
+
+    def _code(self, t, c, day, period, s):
+        index = self.index
+        return ((((t * len(index.class_list) + c) * index.days + day) * index.periods + period)
+                * len(index.subject_list) + s)
+
+    def _position(self, key):
+        index = self.index
+        teacher, class_, day, period, subject = key
+        if (teacher not in index.teacher_code or class_ not in index.class_code or subject not in index.subject_code
+                or day not in range(index.days) or period not in range(index.periods)):
+            return None
+        if self.codes is None:
+            self._sort()
+        code = self._code(index.teacher_code[teacher], index.class_code[class_], int(day), int(period),
+                          index.subject_code[subject])
+        i = np.searchsorted(self.codes, code)
+        return int(self.order[i]) if i < len(self.codes) and self.codes[i] == code else None
+
+    def __len__(self):
+        return self.index.count
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return self.index.handle(position)
+
+    def items(self):
+        index = self.index
+        for (t, c, day, period, s), var in zip(index.key_array().tolist(), index.vars):
+            yield (index.teacher_list[t], index.class_list[c], day, period, index.subject_list[s]), var
+
+
+class _Vars:
+    """CompactIndex.vars 的视图：与 key_array() 的行对应，逐个创建变量句柄"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, position):
+        return self.index.handle(position)
+
+    def __iter__(self):
+        for start in range(0, self.index.count, 4096):
+            yield from self.index.handles(range(start, min(start + 4096, self.index.count)))
+
+
+class CompactIndex:
+    """省内存的决策变量索引，build_model(compact=True) 时使用，属性与 ModelIndex 相同
+
+    决策变量不命名、连续创建，只记录第一个变量在模型中的编号和 keys 的 int32 数组（变量数 × 5）；
+    x、vars、class_slot 等分组都是按需计算的视图，取到一组时才创建这组变量的句柄，用完即释放。
+    分组的下标数组在一个约束族建完后由 release() 释放，内存峰值约为模型本身加上几个整数数组。
+    """
+    compact = True
+
+    def __init__(self, model, teacher_list, class_list, subject_list, days=6, periods=9):
+        self.model = model
+        self.teacher_list = teacher_list
+        self.class_list = class_list
+        self.subject_list = subject_list
+        self.days = days
+        self.periods = periods
+        self.teacher_code = {teacher: i for i, teacher in enumerate(teacher_list)}
+        self.class_code = {class_: i for i, class_ in enumerate(class_list)}
+        self.subject_code = {subject: i for i, subject in enumerate(subject_list)}
+        self.assumptions = []
+        # 第一个决策变量在模型中的编号，决策变量的编号为 first + 行号
+        self.first = None
+        self.count = 0
+        # keys 按行连续存放的 int32 数组，key_array() 直接在其上建 NumPy 视图，不复制
+        self._keys = array('i')
+        self._views = {}
+
+    def add_slots(self, model, teacher, class_, subject, slots):
+        if not slots:
+            return
+        t, c, s = self.teacher_code[teacher], self.class_code[class_], self.subject_code[subject]
+        for day, period in slots:
+            var = model.NewBoolVar('')
+            if self.first is None:
+                self.first = var.Index()
+            self._keys.extend((t, c, day, period, s))
+        self.count += len(slots)
+
+    def var_name(self, name):
+        return ''
+
+    def key_array(self):
+        return np.frombuffer(self._keys, dtype=np.int32).reshape(-1, 5)
+
+    def handle(self, position):
+        return self.model.get_bool_var_from_proto_index(self.first + position)
+
+    def handles(self, positions):
+        get = self.model.get_bool_var_from_proto_index
+        return [get(self.first + position) for position in np.asarray(positions).tolist()]
+
+    def values(self, solver):
+        solution = np.asarray(solver.response_proto.solution)
+        return solution[self.first:self.first + self.count].astype(bool)
+
+    def release(self):
+        self._views.clear()
+
+    def _view(self, name, build):
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = build()
+        return view
+
+    def _groups(self, columns, shape):
+        # 按 columns 列组成的分组编号排序，offsets[g]:offsets[g + 1] 为第 g 组在 order 中的范围
+        keys = self.key_array()
+        group = np.zeros(len(keys), dtype=np.int64)
+        for column, size in zip(columns, shape):
+            group = group * size + keys[:, column]
+        order = np.argsort(group, kind='stable').astype(np.int32)
+        offsets = np.zeros(int(np.prod(shape)) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(group, minlength=len(offsets) - 1), out=offsets[1:])
+        return _Groups(self, order, offsets, shape)
+
+    @property
+    def keys(self):
+        return self.key_array()
+
+    @property
+    def vars(self):
+        return _Vars(self)
+
+    @property
+    def x(self):
+        return self._view('x', lambda: _KeyLookup(self))
+
+    @property
+    def class_slot(self):
+        return self._view('class_slot', lambda: self._groups((1, 2, 3), (len(self.class_list), self.days,
+                                                                          self.periods)))
+
+    @property
+    def teacher_slot(self):
+        return self._view('teacher_slot', lambda: self._groups((0, 2, 3), (len(self.teacher_list), self.days,
+                                                                            self.periods)))
+
+    @property
+    def class_subject(self):
+        return self._view('class_subject', lambda: self._groups((1, 4), (len(self.class_list),
+                                                                        len(self.subject_list))))
+
+    @property
+    def class_subject_day(self):
+        return self._view('class_subject_day', lambda: self._groups((1, 4, 2), (len(self.class_list),
+                                                                                len(self.subject_list), self.days)))
+
+    @property
+    def lesson_day(self):
+        return self._view('lesson_day', lambda: _LessonDays(self))
+
+
+def build_model(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+                fixed_courses=[], weights=None, telemetry=None, assumptions=False, rules=None, compact=False):
+    """建模，返回模型和变量索引
+
+    fixed_courses 为不在本次模型中的班级已经排定的课程（格式与 confirm_courses 相同），
+    这些课程占用教师的时段，并计入教师上午/下午是否有课。
+    rules 为规则集（时间网格、硬约束和软约束），默认为 rules.DEFAULT_RULES，见 rules.py。
+    weights 按规则名覆盖软约束的权重，例如 {'saturday': 0}，权重为 0 的软约束不建模，
+    不是启用的软约束名的键抛出 ValueError，见 rules.soft_weights()。
+    telemetry 为 Telemetry 时记录每条规则的建模耗时和变量、约束数。
+    assumptions 为 True 时每条预排、每条不排课和每个班级每门课程的课时数都由一个假设文字开关，
+    记录在 index.assumptions 中，用于 infeasible_core() 定位无解的原因。
+    compact 为 True 时使用省内存的建模方式，用于全区多校区这样的大规模输入：变量索引为 CompactIndex，
+    变量不命名，每个约束族建完即释放分组，并改用更紧凑的等价约束（至多一个、恰好一个、不建辅助变量的连堂约束，
+    见各规则）；可行解和每个解的目标值都与默认方式相同。
+    节省的内存有限：200 个班级的合成学校上，建模增加的内存约为默认方式的 1/3（201 MB → 62 MB），
+    进程内存峰值约为 1/2（254 MB → 114 MB，其中约 87 MB 是 Python、pandas 和 OR-Tools 本身），
+    没有达到内存峰值降低 5 倍的目标；模型本身（约 13 万个变量）仍占约 45 MB。
+    """
+    rules = rules or DEFAULT_RULES
+    check_rules(rules)
+    days, periods = time_grid(rules)
+    telemetry = telemetry or Telemetry()
+    weights = soft_weights(rules, weights)
 
-def plan(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[]):
     # 教师
     teacher_list = list(teacher_subjects.keys())
 
     # 班级数
     class_list = list(subjects_required.keys())
 
-    # 课程
-    subjects_set = set()
-    for subject_required in subjects_required.values():
-        subjects_set.update(subject_required.keys())
-    subject_list = list(subjects_set)
+    # 课程，按在 subjects_required 中第一次出现的顺序，相同的输入每次建出相同的模型
+    subject_list = list(dict.fromkeys(subject for subject_required in subjects_required.values()
+                                      for subject in subject_required))
 
     # 建模
     model = cp_model.CpModel()
+    if compact:
+        index = CompactIndex(model, teacher_list, class_list, subject_list, days, periods)
+    else:
+        index = ModelIndex(teacher_list, class_list, subject_list, days, periods)
+    telemetry.begin_build(model)
 
-    # 决策变量：教师i在班级j的第k天第l个课时教授课程m
-    x = {}
-    for teacher in teacher_list:
-        for class_ in class_list:
-            for day in range(6):
-                for period in range(9):
-                    for subject in subject_list:
-                        x[teacher, class_, day, period, subject] = model.NewBoolVar(
-                            f"x[{teacher}, {class_}, {day}, {period}, {subject}]"
-                        )
-    # model.Add(x['郑成功', '高三1班', 3, 8, '体育'] == 1)
-    # 预排
-    if len(confirm_courses) > 0:
-        for confirm_course in confirm_courses:
-            model.Add(x[confirm_course.get('teacher_name'), confirm_course.get('class'), confirm_course.get('week'), confirm_course.get('sort'), confirm_course.get('subject')] == 1)
-    # 禁止排课
-    if len(no_courses) > 0:
-        for no_course in no_courses:
-            model.Add(x[no_course.get('teacher_name'), no_course.get('class'), no_course.get('week'), no_course.get('sort'), no_course.get('subject')] == 0)
-
-    # 辅助变量：是否和下一节课连续
-    consecutive = {}
-    for teacher in teacher_list:
-        for class_ in class_list:
-            for day in range(6):
-                for period in range(8):
-                    for subject in subject_list:
-                        consecutive[teacher, class_, day, period, subject] = (
-                            model.NewBoolVar(
-                                f"consecutive[{teacher}, {class_}, {day}, {period}, {subject}]"
-                            )
-                        )
-
-    # 辅助变量：教师在上午或下午是否有课
-    teacher_morning = {}
-    teacher_afternoon = {}
-    for teacher in teacher_list:
-        for day in range(6):
-            teacher_morning[teacher, day] = model.NewBoolVar(f'morning_{teacher}_{day}')
-            teacher_afternoon[teacher, day] = model.NewBoolVar(f'afternoon_{teacher}_{day}')
-
-
-    # 约束条件：每个老师只能给固定的班级授课
-    for class_ in class_list:
-        class_teacher_list = teacher_required.get(class_, {}).values()
-        for teacher in teacher_list:
-            for subject in subject_list:
-                if teacher not in class_teacher_list:
-                    model.Add(
-                        sum(
-                            x[teacher, class_, day, period, subject]
-                            for day in range(6)
-                            for period in range(9)
-                        ) == 0
-                    )
-    # 约束条件：每个老师只教授固定的课程
-    for teacher in teacher_list:
-        for class_ in class_list:
-            for day in range(6):
-                for period in range(9):
-                    for subject in subject_list:
-                        if subject not in teacher_subjects[teacher]:
-                            model.Add(x[teacher, class_, day, period, subject] == 0)
-
-    # 约束条件：每个班级的课时数固定
-    for class_ in class_list:
-        for subject in subject_list:
-            model.Add(
-                sum(
-                    x[teacher, class_, day, period, subject]
-                    for teacher in teacher_list
-                    for day in range(6)
-                    for period in range(9)
-                ) == subjects_required[class_].get(subject, 0)
-            )
-
-    # 约束条件：每个老师在每天相同时段只能出现一次
-    for teacher in teacher_list:
-        for day in range(6):
-            for period in range(9):
-                model.Add(
-                    sum(
-                        x[teacher, class_, day, period, subject]
-                        for class_ in class_list
-                        for subject in subject_list
-                    ) <= 1
-                )
-    # 约束条件：每个班级相同时段只能有一个课程
-    for class_ in class_list:
-        for day in range(6):
-            for period in range(9):
-                model.Add(
-                    sum(
-                        x[teacher, class_, day, period, subject]
-                        for teacher in teacher_list
-                        for subject in subject_list
-                    ) <= 1
-                )
-
-    # 约束条件：体育课不能排在上午前两节
-    for teacher in teacher_list:
-        for class_ in class_list:
-            for day in range(6):
-                for period in range(2):  # 前两节课
-                    model.Add(x[teacher, class_, day, period, '体育'] == 0)
-
-    # 约束条件：体育课只能排在周 456
-    for teacher in teacher_list:
-        for class_ in class_list:
-            for day in range(3):  # 周一、二、三
-                for period in range(9):
-                    model.Add(x[teacher, class_, day, period, '体育'] == 0)
-
-    # 约束条件：每天的第一节、第二节和第六节必须排课
-    for class_ in class_list:
-        for day in range(6):
-            for period in [0, 1, 5]:  # 第一节、第二节和第六节
-                model.Add(sum(x[teacher, class_, day, period, subject]
-                            for teacher in teacher_list
-                            for subject in subject_list) == 1)
+    def done(phase):
+        # 一个约束族建完：记录遥测，释放这个约束族用到的分组
+        telemetry.mark(phase, model)
+        index.release()
 
-    # 约束条件：如果课程数大于6-每天最多上2节，如果课程数小于6-每天最多上1节
-    for class_ in class_list:
-        for subject in subject_list:
-            for day in range(6):
-                subject_count = subjects_required[class_].get(subject, 0)
-                lesson_count = sum(
-                            x[teacher, class_, day, period, subject]
-                            for teacher in teacher_list
-                            for period in range(9)
-                        )
-                if subject_count > 6:
-                    model.Add(lesson_count >= 1)
-                    model.Add(lesson_count <= 2)
-                else:
-                    model.Add(lesson_count <= 1)
-
-    # 约束条件：如果班级当天课程等于2，那么这2节课程必须连续，并且不能在第5节和第6节
-    for teacher in teacher_list:
-        for class_ in class_list:
-            for day in range(6):
-                for subject in subject_list:
-                    # 计算这门课在这一天的总课程数
-                    total_lessons = sum(
-                        x[teacher, class_, day, period, subject] for period in range(9)
-                    )
-                    # 1. 如果有两节课，必须连续
-                    # 创建变量，是否和下一节课连续
-                    consecutive_sum = sum(
-                        consecutive[teacher, class_, day, period, subject]
-                        for period in range(8)
-                    )
-                    # 2 节课，consecutive_sum 为 1
-                    # 1 节课，consecutive_sum 为 0
-                    # 0 节课，consecutive_sum 为 0
-                    model.Add(consecutive_sum >= total_lessons - 1)
-                    # 连续性约束
-                    for period in range(8):
-                        # 连续性为真时，两节课都为真
-                        model.add_bool_and([
-                                x[teacher, class_, day, period, subject],
-                                x[teacher, class_, day, period + 1, subject],
-                        ]).only_enforce_if(
-                            consecutive[teacher, class_, day, period, subject]
-                        )
-                        # 连续性为假时，至少有一节为假
-                        model.AddBoolOr(
-                            [
-                                x[teacher, class_, day, period, subject].Not(),
-                                x[teacher, class_, day, period + 1, subject].Not(),
-                            ]
-                        ).OnlyEnforceIf(
-                            consecutive[teacher, class_, day, period, subject].Not()
-                        )
-                    # 3. 不能在第5节和第6节安排连续的两节课
-                    model.Add(x[teacher, class_, day, 4, subject] + x[teacher, class_, day, 5, subject] <= 1)
-
-    # 约束条件，周1、3、5语文尽量靠前，周2、4、6英语尽量靠前
-    # objective_terms = []
-    # for class_ in class_list:
-    #     for day in range(6):
-    #         if day % 2 == 0:
-    #             # 周1、3、5， 语文课尽量靠前
-    #             teacher = teacher_required.get(class_, {}).get('语文')
-    #             for period in range(9):
-    #                 objective_terms.append(x[teacher, class_, day, period, '语文'] * period)
-    #         else:
-    #             # 周2、4、6，英语课尽量靠前
-    #             teacher = teacher_required.get(class_, {}).get('英语')
-    #             for period in range(9):
-    #                 objective_terms.append(x[teacher, class_, day, period, '英语'] * period)
-    # model.minimize(sum(objective_terms))
-
-
-    # 约束条件：教师当天的课程尽量全部在上午或全部在下午，并且周1、3、5语文尽量靠前，周2、4、6英语尽量靠前
-    morning_periods = range(5) # 0-4 为上午时间段
-    afternoon_periods = range(5, 9)  # 5-8 为下午时间段
-    time_block_penalties = []
-    for teacher in teacher_list:
-        for day in range(6):
-            # 检测上午是否有课
-            morning_classes = []
-            for period in morning_periods:
-                for class_ in class_list:
-                    for subject in subject_list:
-                        morning_classes.append(x[teacher, class_, day, period, subject])
-            model.AddBoolOr(morning_classes).OnlyEnforceIf(teacher_morning[teacher, day])
-            model.AddBoolAnd([v.Not() for v in morning_classes]).OnlyEnforceIf(teacher_morning[teacher, day].Not())
-
-            # 检测下午是否有课
-            afternoon_classes = []
-            for period in afternoon_periods:
-                for class_ in class_list:
-                    for subject in subject_list:
-                        afternoon_classes.append(x[teacher, class_, day, period, subject])
-            model.AddBoolOr(afternoon_classes).OnlyEnforceIf(teacher_afternoon[teacher, day])
-            model.AddBoolAnd([v.Not() for v in afternoon_classes]).OnlyEnforceIf(teacher_afternoon[teacher, day].Not())
-
-            # 创建时间块惩罚变量
-            time_block_penalty = model.NewBoolVar(f'time_block_penalty_{teacher}_{day}')
-            model.AddBoolAnd([teacher_morning[teacher, day],
-                              teacher_afternoon[teacher, day]]).OnlyEnforceIf(time_block_penalty)
-            model.AddBoolOr([teacher_morning[teacher, day].Not(),
-                             teacher_afternoon[teacher, day].Not()]).OnlyEnforceIf(time_block_penalty.Not())
-
-            time_block_penalties.append(time_block_penalty)
-    # === 第二部分：周1、3、5语文尽量靠前，周2、4、6英语尽量靠前 ===
-    subject_time_costs = []
+    # 禁止排课的时段不再创建变量
+    no_course_keys = set()
+    for no_course in no_courses:
+        no_course_keys.add(course_key(no_course))
 
-    for class_ in class_list:
-        for day in range(6):
-            for period in range(9):
-                for teacher in teacher_list:
-                    # 语文课在周1、3、5的权重
-                    if day in [0, 2, 4]:  # 周1、3、5
-                        for subject in subject_list:
-                            if subject == "语文":
-                                # 创建整型变量表示课程位置的代价
-                                cost = model.NewIntVar(0, period, f'chinese_cost_{class_}_{day}_{period}')
-                                # 如果这个时间段安排了语文课，代价等于period值（越往后代价越大）
-                                model.Add(cost == period).OnlyEnforceIf(x[teacher, class_, day, period, subject])
-                                model.Add(cost == 0).OnlyEnforceIf(x[teacher, class_, day, period, subject].Not())
-                                subject_time_costs.append(cost)
-
-                    # 英语课在周2、4、6的权重
-                    if day in [1, 3, 5]:  # 周2、4、6
-                        for subject in subject_list:
-                            if subject == "英语":
-                                cost = model.NewIntVar(0, period, f'english_cost_{class_}_{day}_{period}')
-                                model.Add(cost == period).OnlyEnforceIf(x[teacher, class_, day, period, subject])
-                                model.Add(cost == 0).OnlyEnforceIf(x[teacher, class_, day, period, subject].Not())
-                                subject_time_costs.append(cost)
-    # === 第三部分：尽量避免在周六安排连堂课
-    # 创建用于记录惩罚变量的列表
-    penalty = {}  # 用于存储每个班级和课程的惩罚变量
-    penalty_weight = 10  # 惩罚权重
+    # 其他班级已排定的课程占用的教师时段
+    busy_teacher_slots = set()
+    for fixed_course in fixed_courses:
+        busy_teacher_slots.add((fixed_course.get('teacher_name'), fixed_course.get('week'), fixed_course.get('sort')))
 
+    # 决策变量：教师i在班级j的第k天第l个课时教授课程m
+    # 只为允许的组合创建变量：教师必须是该班级的任课教师（teacher_required），且能教授该课程（teacher_subjects），
+    # 规则排除的时段（例如体育课）和禁止排课的时段也不创建变量，等价于原先把这些变量固定为 0
+    subject_slots = {subject: allowed_slots(rules, subject) for subject in subject_list}
     for class_ in class_list:
-        for subject in subject_list:
-            # 正确统计每个时段的课程情况
-            saturday_classes = []
-            for period in range(9):
-                period_sum = []
-                for teacher in teacher_list:
-                    period_sum.append(x[teacher, class_, 5, period, subject])
-                # 每个时段最多只有一节课
-                saturday_classes.append(sum(period_sum))
-
-            # 创建布尔惩罚变量
-            penalty[class_, subject] = model.NewBoolVar(f"penalty[{class_}, {subject}]")
-
-            # 正确的布尔约束：当课程数量>=2时，penalty为1；否则为0
-            model.Add(sum(saturday_classes) >= 2).OnlyEnforceIf(penalty[class_, subject])
-            model.Add(sum(saturday_classes) < 2).OnlyEnforceIf(penalty[class_, subject].Not())
-
-    # 目标函数：最小化惩罚项的总和
-    # model.Minimize()
-
-    # === 组合两个优化目标 ===
-    # 将时间块惩罚转换为整数值并设置权重
-    time_block_cost = sum(time_block_penalties)  # 给较大权重确保这是主要优化目标
-
-    # 科目时间优化代价
-    subject_time_total_cost = sum(subject_time_costs) * 100
-
-    # 最小化
-    not_in_saturday = sum(penalty[class_, subject] for class_ in class_list for subject in subject_list) * penalty_weight
-
-    # 总体优化目标：最小化加权和
-    model.Minimize(time_block_cost + subject_time_total_cost + not_in_saturday)
-
-    # [Rest of the code remains the same]
+        # 约束条件：每个老师只能给固定的班级授课
+        for teacher in dict.fromkeys(teacher_required.get(class_, {}).values()):
+            if teacher not in index.teacher_code:
+                continue
+            # 约束条件：每个老师只教授固定的课程
+            for subject in teacher_subjects[teacher]:
+                if subject not in index.subject_code:
+                    continue
+                index.add_slots(model, teacher, class_, subject, [
+                    (day, period) for day, period in subject_slots[subject]
+                    if (assumptions or (teacher, class_, day, period, subject) not in no_course_keys)
+                    and (teacher, day, period) not in busy_teacher_slots
+                ])
+    x = index.x
+
+    def assumption(description):
+        literal = model.NewBoolVar(f"assumption[{len(index.assumptions)}]")
+        index.assumptions.append((literal, description))
+        return literal
+
+    if assumptions:
+        # 不排课的变量保留，由假设文字固定为 0
+        for key in no_course_keys:
+            if key in x:
+                model.Add(x[key] == 0).OnlyEnforceIf(
+                    assumption(f"不排课：{key[1]}-{key[0]}-{key[4]}（{WEEKDAYS[key[2]]}{PERIODS[key[3]]}）"))
+    done('决策变量')
+    # 预排
+    for confirm_course in confirm_courses:
+        key = course_key(confirm_course)
+        if assumptions:
+            slot = f"{WEEKDAYS[key[2]]}{PERIODS[key[3]]}" if key in x else f"第 {key[2]} 天第 {key[3]} 节"
+            literal = assumption(f"课程预排：{key[1]}-{key[0]}-{key[4]}（{slot}）")
+            if key in x:
+                model.Add(x[key] == 1).OnlyEnforceIf(literal)
+            else:
+                model.AddBoolOr([literal.Not()])
+        elif key in x:
+            model.Add(x[key] == 1)
+        else:
+            # 预排的课程在不允许的组合或时段上，模型无解
+            model.AddBoolOr([])
 
+    del x
+    done('预排')
 
+    # 约束条件：每个班级的课时数固定
+    for c, class_ in enumerate(class_list):
+        for s, subject in enumerate(subject_list):
+            hours = subjects_required[class_].get(subject, 0)
+            constraint = model.Add(cp_model.LinearExpr.Sum(index.class_subject[c][s]) == hours)
+            if assumptions:
+                constraint.OnlyEnforceIf(assumption(f"课时数：{class_} 的 {subject} 每周 {hours} 课时"))
 
-    # 求解
-    solver = cp_model.CpSolver()
+    done('课时数')
 
-    # 使用的线程数
-    # solver.parameters.num_search_workers = 1
+    # 约束条件：每个老师在每天相同时段只能出现一次
+    for teacher_days in index.teacher_slot:
+        for teacher_periods in teacher_days:
+            for teacher_classes in teacher_periods:
+                if len(teacher_classes) > 1:
+                    add_at_most_one(model, index, teacher_classes)
+    done('教师时段冲突')
+    # 约束条件：每个班级相同时段只能有一个课程
+    for class_days in index.class_slot:
+        for class_periods in class_days:
+            for class_courses in class_periods:
+                if len(class_courses) > 1:
+                    add_at_most_one(model, index, class_courses)
+
+    done('班级时段冲突')
+
+    # 规则集中的硬约束
+    context = {'subjects_required': subjects_required, 'teacher_required': teacher_required,
+               'confirm_courses': confirm_courses, 'no_courses': no_courses,
+               'busy_teacher_slots': busy_teacher_slots, 'rules': rules}
+    for rule in enabled_rules(rules, 'hard'):
+        compile_rule = HARD_RULES[rule['type']]
+        if compile_rule is not None:
+            compile_rule(model, index, rule, context)
+            done(rule['name'])
+
+    # 规则集中的软约束：目标函数为各代价的加权和，权重为 0 的软约束不建模
+    objective_terms = []
+    for rule in enabled_rules(rules, 'soft'):
+        if weights[rule['name']] == 0:
+            continue
+        objective_terms.append(SOFT_RULES[rule['type']](model, index, rule, context) * weights[rule['name']])
+        done(rule['name'])
+
+    if objective_terms:
+        model.Minimize(cp_model.LinearExpr.Sum(objective_terms))
+    telemetry.mark('目标函数', model)
+    if assumptions:
+        model.AddAssumptions([literal for literal, _ in index.assumptions])
+    telemetry.end_build(model)
+
+    return model, index
+
+
+def read_timetable(path):
+    """读取已有的排课结果，返回与 confirm_courses 格式相同的课程列表
+
+    支持 plan() 导出的 排课结果_班级.xlsx（每个班级一个 sheet，单元格为“课程（教师）”），
+    export_timetable() 导出的 CSV / Parquet 排课结果表，以及 plan() 返回值保存成的 JSON 文件。
+    """
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    if path.endswith('.csv'):
+        return table_courses(pd.read_csv(path, encoding='utf-8-sig'))
+    if path.endswith('.parquet'):
+        return table_courses(pd.read_parquet(path))
+
+    courses = []
+    for class_, df in pd.read_excel(path, sheet_name=None, index_col=0).items():
+        for period_name, row in df.iterrows():
+            for day_name, cell in row.items():
+                if pd.isna(cell):
+                    continue
+                subject, teacher = str(cell).rstrip('）').split('（', 1)
+                courses.append({'class': class_,
+                                'teacher_name': teacher,
+                                'subject': subject,
+                                'week': WEEKDAYS.index(day_name),
+                                'sort': PERIODS.index(period_name)})
+    return courses
+
+
+def add_hints(model, index, hints):
+    """把已有的排课结果作为求解提示：提示中的课程为 1，涉及班级的其余变量为 0
+
+    提示与当前输入不一致的部分（教师、课程或时段已不存在）会被忽略，由求解器自行修复。
+    """
+    hinted = set()
+    for hint in hints:
+        key = course_key(hint)
+        if key in index.x:
+            hinted.add(key)
+    hinted_classes = {key[1] for key in hinted}
+    for key, course in index.x.items():
+        if key in hinted:
+            model.AddHint(course, 1)
+        elif key[1] in hinted_classes:
+            model.AddHint(course, 0)
+
+
+def solve_model(model, index, time_limit=3600, stop_at_first_solution=False, relative_gap=None, solver=None,
+                telemetry=None, stop_policy=None, as_table=False, on_solution=None):
+    """求解模型，返回求解状态和排出的课程列表（格式与 confirm_courses 相同），无解时课程列表为 None
+
+    solver 为调用方创建的 CpSolver，可以预先设置线程数等参数，求解后从中读取目标值和耗时。
+    telemetry 为 Telemetry 时记录每个改进解、下界变化和最终状态；
+    stop_policy 为提前停止策略，例如 telemetry.NoImprovement(60) 或 telemetry.GapBelow(1)；
+    as_table 为 True 时返回排课结果表（见 extract_assignments()）而不是课程列表；
+    on_solution 不为空时在求解过程中对每个改进解调用 on_solution(排课结果表)，在求解线程中执行。
+    """
+    if solver is None:
+        solver = cp_model.CpSolver()
+
+        # 使用的线程数
+        # solver.parameters.num_search_workers = 1
+
+        # 开启搜索进度
+        solver.parameters.log_search_progress = True
 
     # 限制求解时间
-    solver.parameters.max_time_in_seconds = 3600
-
-    # 开启搜索进度
-    solver.parameters.log_search_progress = True
-
-    status = solver.Solve(model)
+    solver.parameters.max_time_in_seconds = time_limit
+
+    # 找到第一个可行解或达到目标差距即停止
+    if stop_at_first_solution:
+        solver.parameters.stop_after_first_solution = True
+    if relative_gap is not None:
+        solver.parameters.relative_gap_limit = relative_gap
+
+    if telemetry is not None or stop_policy is not None or on_solution is not None:
+        extract = None
+        if on_solution is not None:
+            def extract(callback):
+                on_solution(extract_assignments(callback, index))
+        status = SolveMonitor(telemetry or Telemetry(), stop_policy, on_solution=extract).solve(solver, model)
+    else:
+        status = solver.Solve(model)
 
     if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
         # 求解结果状态
@@ -334,40 +587,143 @@ def plan(teacher_subjects, subjects_required, teacher_required={}, confirm_cours
         else:
             print("Feasible solution")
 
-        # 求解结果
-        df_class_dict = {}
-        df_teacher_dict = {}
-
-        # 创建星期和课时
-        weekdays = ["周一", "周二", "周三", "周四", "周五", "周六"]
-        periods = ["第一节", "第二节", "第三节", "第四节", "第五节", "第六节", "第七节", "第八节", "第九节",]
-
-        # 为每个班级创建一个 df
-        for class_ in class_list:
-            df_class_dict[class_] = pd.DataFrame(index=periods, columns=weekdays)
-        # 为每个教师创建一个df
-        for teacher in teacher_list:
-            df_teacher_dict[teacher] = pd.DataFrame(index=periods, columns=weekdays)
-
-        # 解析结果
-        for teacher in teacher_list:
-            for class_ in class_list:
-                for day in range(6):
-                    for period in range(9):
-                        for subject in subject_list:
-                            if (solver.Value(x[teacher, class_, day, period, subject]) == 1):
-                                df_class_dict[class_].loc[periods[period], weekdays[day]] = f"{subject}（{teacher}）"
-                                df_teacher_dict[teacher].loc[periods[period], weekdays[day]] = f"{subject}（{class_}）"
-
-        # 处理结果，每个 df 一个 sheet
-        with pd.ExcelWriter("排课结果_班级.xlsx") as writer:
-            # 将每个DataFrame写入不同的sheet
-            for class_, df in df_class_dict.items():
-                df.to_excel(writer, sheet_name=class_)
-        # 处理结果，教师课程导出
-        with pd.ExcelWriter("排课结果_教师.xlsx") as writer:
-            for teacher, df in df_teacher_dict.items():
-                df.to_excel(writer, sheet_name=teacher)
+        table = extract_assignments(solver, index)
+        return status, table if as_table else table_courses(table)
 
     else:
-        print("No optimal solution found.")
\ No newline at end of file
+        print("No optimal solution found.")
+        return status, None
+
+
+def infeasible_core(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+                    fixed_courses=[], time_limit=60, minimize=True, rules=None):
+    """计数检查通过但模型仍然无解时，定位无解的原因
+
+    每条预排、每条不排课和每个班级每门课程的课时数作为一个假设，返回一组同时成立时无解的假设说明；
+    minimize 为 True 时逐个尝试去掉其中的假设，得到不可再缩小的一组。
+    有解时返回空列表，在 time_limit 秒内无法判定时返回 None。
+    """
+    model, index = build_model(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses,
+                               fixed_courses, assumptions=True, rules=rules)
+    # 只判断可行性，不需要目标函数；假设核心只在单线程搜索中给出
+    model.ClearObjective()
+    solver = cp_model.CpSolver()
+    solver.parameters.num_search_workers = 1
+    solver.parameters.max_time_in_seconds = time_limit
+
+    status = solver.Solve(model)
+    if status != cp_model.INFEASIBLE:
+        return [] if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None
+    literals = {literal.Index(): (literal, description) for literal, description in index.assumptions}
+    core = [literals[i] for i in solver.SufficientAssumptionsForInfeasibility()]
+
+    if minimize:
+        for candidate in list(core):
+            if len(core) == 1:
+                break
+            if candidate not in core:
+                continue
+            rest = [item for item in core if item is not candidate]
+            model.ClearAssumptions()
+            model.AddAssumptions([literal for literal, _ in rest])
+            if solver.Solve(model) == cp_model.INFEASIBLE:
+                kept = set(solver.SufficientAssumptionsForInfeasibility())
+                core = [item for item in rest if item[0].Index() in kept]
+    return [description for _, description in core]
+
+
+def extract_assignments(solver, index):
+    """一次取出全部决策变量的值，返回排课结果表：每行一节课，列为 COLUMNS，班级、课程、教师为分类编码
+
+    solver 为求解后的 CpSolver，或求解回调（取当前解）。
+    """
+    keys = index.key_array()[index.values(solver)]
+    table = pd.DataFrame({
+        'class': pd.Categorical.from_codes(keys[:, 1], categories=index.class_list),
+        'week': keys[:, 2],
+        'sort': keys[:, 3],
+        'subject': pd.Categorical.from_codes(keys[:, 4], categories=index.subject_list),
+        'teacher_name': pd.Categorical.from_codes(keys[:, 0], categories=index.teacher_list),
+    })
+    return table[COLUMNS]
+
+
+def stop_policy_key(stop_policy):
+    """提前停止策略在缓存指纹中的表示，即策略的 cache_key()；没有 cache_key() 的策略无法比较，返回 None"""
+    if stop_policy is None or not hasattr(stop_policy, 'cache_key'):
+        return None
+    return stop_policy.cache_key()
+
+
+def plan(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+         hints=None, stop_at_first_solution=False, relative_gap=None, time_limit=3600, weights=None,
+         telemetry=None, stop_policy=None, output_dir='.', formats=('excel',), precheck=True, rules=None,
+         symmetry_breaking=False, compact=False, cache=None, on_solution=None, solver=None):
+    """排课并导出结果，返回排出的课程列表（格式与 confirm_courses 相同），无解时返回 None
+
+    hints 为上一次的排课结果（例如 read_timetable() 的返回值），作为求解提示热启动；
+    stop_at_first_solution 为 True 时找到第一个可行解即停止；
+    relative_gap 为目标值与下界的相对差距，达到后即停止，例如 0.05；
+    rules 为规则集（时间网格、硬约束和软约束），默认为 rules.DEFAULT_RULES；
+    symmetry_breaking 为 True 时在规则集中加入 rules.SYMMETRY_RULES 中的冗余约束和对称性破除；
+    weights 按规则名覆盖规则集中软约束的权重，见 build_model()；
+    telemetry 为 Telemetry 时记录建模和求解过程的事件，stop_policy 为提前停止策略，见 solve_model()；
+    结果按 formats（excel、csv、parquet）导出到 output_dir，见 export_timetable()，格式在建模前用 check_formats() 检查；
+    precheck 为 True 时先用 check_feasibility() 做计数检查，输入不可能有解时抛出 ValueError，列出全部问题；
+    compact 为 True 时使用省内存的建模方式，用于全区多校区这样的大规模输入，见 build_model()；
+    cache 为 cache.ResultCache 时按规范化输入和求解参数的指纹缓存结果：相同的输入直接返回缓存的课表，
+    否则没有 hints 时用最相似的缓存结果作为求解提示，求得的课表写入缓存；
+    stop_policy 没有 cache_key()（例如普通函数）时无法判断两次的停止条件是否相同，不使用缓存；
+    on_solution 不为空时对求解过程中的每个改进解调用 on_solution(排课结果表)，见 solve_model()；
+    solver 为调用方创建的 CpSolver，可以预先设置线程数、是否输出求解日志等参数，见 solve_model()。
+    """
+    check_formats(formats)
+    if symmetry_breaking:
+        rules = with_symmetry_breaking(rules)
+    if cache is not None and stop_policy is not None and not hasattr(stop_policy, 'cache_key'):
+        if telemetry is not None:
+            telemetry.emit('cache_bypass', reason=f"提前停止策略 {type(stop_policy).__name__} 没有 cache_key()")
+        cache = None
+    if cache is not None:
+        effective_rules = rules or DEFAULT_RULES
+        problem = canonical_problem(
+            teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses, effective_rules,
+            soft_weights(effective_rules, weights),
+            {'time_limit': time_limit, 'stop_at_first_solution': stop_at_first_solution,
+             'relative_gap': relative_gap, 'compact': compact,
+             'stop_policy': stop_policy_key(stop_policy)})
+        key = fingerprint(problem)
+        entry = cache.get(key)
+        if entry is not None:
+            if telemetry is not None:
+                telemetry.emit('cache_hit', fingerprint=key, status=entry['status'])
+            export_timetable(entry['courses'], list(subjects_required.keys()), list(teacher_subjects.keys()),
+                             output_dir, formats)
+            return entry['courses']
+        if not hints:
+            score, entry = cache.nearest(problem)
+            if entry is not None:
+                hints = entry['courses']
+                if telemetry is not None:
+                    telemetry.emit('cache_nearest', fingerprint=entry['fingerprint'], similarity=round(score, 4))
+    if precheck:
+        errors = check_feasibility(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses,
+                                   rules=rules)
+        if errors:
+            raise ValueError(f"输入不可能有解，有 {len(errors)} 处问题：\n" + "\n".join(errors))
+    model, index = build_model(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses,
+                               weights=weights, telemetry=telemetry, rules=rules, compact=compact)
+    if hints:
+        add_hints(model, index, hints)
+
+    # 求解
+    status, table = solve_model(model, index, time_limit, stop_at_first_solution, relative_gap, solver=solver,
+                                telemetry=telemetry, stop_policy=stop_policy, as_table=True, on_solution=on_solution)
+    if table is None:
+        return None
+    export_timetable(table, index.class_list, index.teacher_list, output_dir, formats)
+    courses = table_courses(table)
+    # 被外部中断（例如服务中取消的任务）的结果不是这组参数下的正常结果，不写入缓存
+    if cache is not None and not getattr(stop_policy, 'interrupted', False):
+        cache.put(key, problem, courses, 'OPTIMAL' if status == cp_model.OPTIMAL else 'FEASIBLE')
+    return courses
@@ -0,0 +1,207 @@
+import argparse
+import csv
+import json
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ortools.sat.python import cp_model
+
+from generator import generate_school
+from lns import lns
+from rules import with_symmetry_breaking
+from TimeTable import build_model
+from twostage import two_stage
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ObjectiveRecorder(cp_model.CpSolverSolutionCallback):
+    """记录每个改进解出现的时间、目标值和下界"""
+
+    def __init__(self):
+        super().__init__()
+        self.history = []
+
+    def on_solution_callback(self):
+        self.history.append([round(self.WallTime(), 3), self.ObjectiveValue(), self.BestObjectiveBound()])
+
+
+def _build(class_count, seed=0, rules=None, compact=False, **generator_options):
+    school = generate_school(class_count, seed, **generator_options)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    model, index = build_model(**school, rules=rules, compact=compact)
+    build_seconds = time.perf_counter() - start
+    rss_after = peak_rss_mb()
+    proto = model.Proto()
+    return {
+        'classes': class_count,
+        'seed': seed,
+        'teachers': len(school['teacher_subjects']),
+        'compact': compact,
+        'variables': len(proto.variables),
+        'constraints': len(proto.constraints),
+        'build_seconds': round(build_seconds, 3),
+        'peak_rss_mb': round(rss_after, 1),
+        'build_rss_mb': round(rss_after - rss_before, 1),
+    }, model
+
+
+def measure_build(class_count, seed=0, compact=False, **generator_options):
+    """在当前进程中为合成学校建模，返回模型规模、建模耗时和内存峰值；compact 见 build_model()"""
+    return _build(class_count, seed, compact=compact, **generator_options)[0]
+
+
+def measure_solve(class_count, seed=0, time_limit=60, workers=0, symmetry_breaking=False, **generator_options):
+    """建模并求解合成学校，记录首个可行解时间、目标值随时间的变化、证明最优的时间和最终下界
+
+    symmetry_breaking 为 True 时在模型中加入 rules.SYMMETRY_RULES 中的冗余约束和对称性破除。
+    """
+    rules = with_symmetry_breaking() if symmetry_breaking else None
+    result, model = _build(class_count, seed, rules, **generator_options)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_search_workers = workers
+    recorder = ObjectiveRecorder()
+    status = solver.Solve(model, recorder)
+
+    history = recorder.history
+    result.update({
+        'strategy': 'symmetry' if symmetry_breaking else 'single',
+        'status': solver.StatusName(status),
+        'solve_seconds': round(solver.WallTime(), 3),
+        'optimal_seconds': round(solver.WallTime(), 3) if status == cp_model.OPTIMAL else None,
+        'first_solution_seconds': history[0][0] if history else None,
+        'first_objective': history[0][1] if history else None,
+        'objective': history[-1][1] if history else None,
+        'best_bound': solver.BestObjectiveBound() if history else None,
+        'solutions': len(history),
+        'objective_history': history,
+    })
+    return result
+
+
+def measure_lns(class_count, seed=0, time_limit=60, workers=0, **generator_options):
+    """用大邻域搜索求解合成学校，记录方式与 measure_solve 相同，便于对比目标值随时间的变化"""
+    school = generate_school(class_count, seed, **generator_options)
+    start = time.perf_counter()
+    courses, log = lns(**school, time_limit=time_limit, sub_time_limit=max(time_limit / 20, 5),
+                       workers=workers or None, seed=seed)
+    history = [[elapsed, objective, None] for elapsed, objective, name in log]
+    return {
+        'classes': class_count,
+        'seed': seed,
+        'teachers': len(school['teacher_subjects']),
+        'strategy': 'lns',
+        'status': 'FEASIBLE' if courses is not None else 'UNKNOWN',
+        'solve_seconds': round(time.perf_counter() - start, 3),
+        'first_solution_seconds': history[0][0] if history else None,
+        'first_objective': history[0][1] if history else None,
+        'objective': history[-1][1] if history else None,
+        'solutions': len(history),
+        'objective_history': history,
+    }
+
+
+def measure_two_stage(class_count, seed=0, time_limit=60, workers=0, **generator_options):
+    """用两阶段求解合成学校，记录方式与 measure_solve 相同；first_* 为第一阶段的可行课表"""
+    school = generate_school(class_count, seed, **generator_options)
+    start = time.perf_counter()
+    courses, log = two_stage(**school, stage1_time_limit=time_limit, time_limit=time_limit, workers=workers)
+    history = [[elapsed, objective, None] for elapsed, objective, name in log]
+    return {
+        'classes': class_count,
+        'seed': seed,
+        'teachers': len(school['teacher_subjects']),
+        'strategy': 'two_stage',
+        'status': 'FEASIBLE' if courses is not None else 'UNKNOWN',
+        'solve_seconds': round(time.perf_counter() - start, 3),
+        'first_solution_seconds': history[0][0] if history else None,
+        'first_objective': history[0][1] if history else None,
+        'objective': min((objective for _, objective, _ in history if objective is not None), default=None),
+        'solutions': len(history),
+        'objective_history': history,
+    }
+
+
+def run_in_fresh_process(function, *args, **kwargs):
+    # 每个实例都在新进程中运行，保证内存峰值互不影响
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(function, *args, **kwargs).result()
+
+
+def run_build_benchmark(sizes, seed=0, compact=False, **generator_options):
+    return [run_in_fresh_process(measure_build, class_count, seed, compact, **generator_options)
+            for class_count in sizes]
+
+
+def run_solve_benchmark(sizes, seeds=(0,), time_limit=60, workers=0, strategy='single', **generator_options):
+    results = []
+    for class_count in sizes:
+        for seed in seeds:
+            if strategy in ('lns', 'two_stage'):
+                measure = measure_lns if strategy == 'lns' else measure_two_stage
+                result = run_in_fresh_process(measure, class_count, seed, time_limit, workers, **generator_options)
+            else:
+                result = run_in_fresh_process(measure_solve, class_count, seed, time_limit, workers,
+                                              strategy == 'symmetry', **generator_options)
+            results.append(result)
+    return results
+
+
+def write_results(results, path):
+    """按扩展名写出 JSON 或 CSV；CSV 中目标值历史以 JSON 字符串保存"""
+    if path.endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        return
+    columns = list(dict.fromkeys(column for result in results for column in result))
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for result in results:
+            row = dict(result)
+            if 'objective_history' in row:
+                row['objective_history'] = json.dumps(row['objective_history'])
+            writer.writerow(row)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='排课模型基准测试：建模耗时、内存峰值和求解过程')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20, 40, 100], help='合成学校的班级数')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--confirm', type=int, default=0, help='每个实例随机预排的课程数')
+    parser.add_argument('--no-course', type=int, default=0, help='每个实例随机禁止排课的条数')
+    parser.add_argument('--solve', action='store_true', help='建模后求解，记录首个可行解和目标值变化')
+    parser.add_argument('--time-limit', type=float, default=60, help='每个实例的求解时间上限（秒）')
+    parser.add_argument('--strategy', choices=['single', 'symmetry', 'lns', 'two_stage'], default='single',
+                        help='single 为一次性求解整个模型，symmetry 为加入冗余约束和对称性破除后一次性求解，'
+                             'lns 为大邻域搜索，two_stage 为先求可行课表再优化软约束')
+    parser.add_argument('--workers', type=int, default=0, help='CP-SAT 线程数，0 表示使用全部核心')
+    parser.add_argument('--compact', action='store_true', help='建模基准使用省内存的建模方式（build_model(compact=True)）')
+    parser.add_argument('--output', help='结果文件路径，.json 或 .csv')
+    args = parser.parse_args()
+
+    generator_options = {'confirm_count': args.confirm, 'no_course_count': args.no_course}
+    if args.solve:
+        results = run_solve_benchmark(args.sizes, args.seeds, args.time_limit, args.workers, args.strategy,
+                                      **generator_options)
+        columns = ['classes', 'seed', 'strategy', 'status', 'first_solution_seconds', 'objective', 'best_bound',
+                   'optimal_seconds', 'solve_seconds']
+    else:
+        results = []
+        for seed in args.seeds:
+            results.extend(run_build_benchmark(args.sizes, seed, args.compact, **generator_options))
+        columns = ['classes', 'seed', 'teachers', 'compact', 'variables', 'constraints', 'build_seconds',
+                   'peak_rss_mb', 'build_rss_mb']
+
+    print('\t'.join(columns))
+    for result in results:
+        print('\t'.join(str(result.get(column)) for column in columns))
+    if args.output:
+        write_results(results, args.output)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from export import course_key
+
+# 缓存格式或建模方式变化时修改版本号，旧结果会自动失效
+CACHE_VERSION = 2
+
+
+def canonical_problem(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+                      rules=None, weights=None, solver_options=None):
+    """规范化的排课输入：与字典键、列表的顺序和重复的预排、不排课无关，可以直接序列化为 JSON
+
+    rules、weights 为 build_model() 实际使用的规则集和软约束权重，solver_options 为影响结果的求解参数
+    （时间上限、提前停止条件等），None 表示默认值。
+    """
+    return {
+        'teacher_subjects': {teacher: sorted(set(subjects)) for teacher, subjects in sorted(teacher_subjects.items())},
+        'subjects_required': {class_: dict(sorted(required.items()))
+                              for class_, required in sorted(subjects_required.items())},
+        'teacher_required': {class_: dict(sorted(teachers.items()))
+                             for class_, teachers in sorted(teacher_required.items())},
+        'confirm_courses': sorted({course_key(course) for course in confirm_courses}, key=repr),
+        'no_courses': sorted({course_key(course) for course in no_courses}, key=repr),
+        'rules': rules,
+        'weights': dict(sorted(weights.items())) if weights else None,
+        'solver_options': dict(sorted(solver_options.items())) if solver_options else None,
+    }
+
+
+def fingerprint(problem):
+    """规范化输入（canonical_problem() 的返回值）的 SHA-256 指纹"""
+    text = json.dumps(problem, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(f"v{CACHE_VERSION}:{text}".encode('utf-8')).hexdigest()
+
+
+def problem_facts(problem):
+    """规范化输入中的每一条设置（课时、任课教师、教师课程、预排、不排课），用于比较两个输入有多接近"""
+    facts = set()
+    for class_, required in problem['subjects_required'].items():
+        facts.update(('hours', class_, subject, hours) for subject, hours in required.items())
+    for class_, teachers in problem['teacher_required'].items():
+        facts.update(('teacher', class_, subject, teacher) for subject, teacher in teachers.items())
+    for teacher, subjects in problem['teacher_subjects'].items():
+        facts.update(('teaches', teacher, subject) for subject in subjects)
+    facts.update(('confirm', *course) for course in problem['confirm_courses'])
+    facts.update(('no_course', *course) for course in problem['no_courses'])
+    return facts
+
+
+def _jaccard(first, second):
+    union = len(first | second)
+    return len(first & second) / union if union else 1.0
+
+
+def similarity(first, second):
+    """两个规范化输入的相似度：设置集合的 Jaccard 系数，1 表示输入完全相同（不比较规则和求解参数）"""
+    return _jaccard(problem_facts(first), problem_facts(second))
+
+
+class ResultCache:
+    """按规范化输入指纹保存排课结果的磁盘缓存
+
+    每个结果一个 JSON 文件（result-v{CACHE_VERSION}-{指纹}.json），包含规范化输入、求解状态和课程列表；
+    另有一个只含 problem_facts() 的小文件（facts-v{CACHE_VERSION}-{指纹}.json），nearest() 只读这些小文件比较相似度，
+    读过的设置集合保存在内存中，最后只读取最相似的一个结果。
+    文件总大小超过 max_bytes 时按最近使用时间淘汰最旧的结果，读取命中的结果会刷新其使用时间。
+    """
+
+    def __init__(self, cache_dir='.cache', max_bytes=100 << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # 指纹 -> 规范化输入的设置集合
+        self._facts = {}
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"result-v{CACHE_VERSION}-{key}.json")
+
+    def facts_path(self, key):
+        return os.path.join(self.cache_dir, f"facts-v{CACHE_VERSION}-{key}.json")
+
+    def _entries(self):
+        # (路径, 大小, 最近使用时间)，最旧的在前
+        if not os.path.isdir(self.cache_dir):
+            return []
+        prefix = f"result-v{CACHE_VERSION}-"
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and name.endswith('.json'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def _load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get(self, key):
+        """指纹为 key 的结果（包含 problem、status、courses 的字典），没有时返回 None"""
+        path = self.path(key)
+        entry = self._load(path)
+        if entry is not None:
+            os.utime(path)
+        return entry
+
+    def _write(self, path, data):
+        # 写入临时文件后再改名，其他进程不会读到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def put(self, key, problem, courses, status):
+        """保存结果和它的设置集合，并按大小淘汰旧结果"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {'fingerprint': key, 'problem': problem, 'status': status, 'courses': courses,
+                 'created': time.time()}
+        facts = problem_facts(problem)
+        # 先写设置集合：nearest() 看到结果文件时它一定已经存在
+        self._write(self.facts_path(key), sorted(facts, key=repr))
+        self._write(self.path(key), entry)
+        self._facts[key] = facts
+        self.evict()
+
+    def _entry_facts(self, key):
+        # 结果的设置集合：依次取内存、facts 文件，都没有时读取结果本身并补写 facts 文件
+        facts = self._facts.get(key)
+        if facts is None:
+            stored = self._load(self.facts_path(key))
+            if stored is not None:
+                facts = {tuple(fact) for fact in stored}
+            else:
+                entry = self._load(self.path(key))
+                if entry is None:
+                    return None
+                facts = problem_facts(entry['problem'])
+                self._write(self.facts_path(key), sorted(facts, key=repr))
+            self._facts[key] = facts
+        return facts
+
+    def evict(self):
+        """删除最久未使用的结果，直到文件总大小不超过 max_bytes，返回删除的文件数"""
+        entries = []
+        for path, size, _ in self._entries():
+            key = self._key(path)
+            try:
+                size += os.path.getsize(self.facts_path(key))
+            except FileNotFoundError:
+                pass
+            entries.append((key, size))
+        total = sum(size for _, size in entries)
+        removed = 0
+        for key, size in entries:
+            if total <= self.max_bytes:
+                break
+            for path in (self.path(key), self.facts_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._facts.pop(key, None)
+            total -= size
+            removed += 1
+        return removed
+
+    def _key(self, path):
+        return os.path.basename(path)[len(f"result-v{CACHE_VERSION}-"):-len('.json')]
+
+    def nearest(self, problem, min_similarity=0.5):
+        """与规范化输入 problem 最相似的已缓存结果，返回（相似度，结果），相似度低于 min_similarity 时返回 (0, None)"""
+        facts = problem_facts(problem)
+        scores = []
+        for path, _, _ in self._entries():
+            key = self._key(path)
+            entry_facts = self._entry_facts(key)
+            if entry_facts is None:
+                continue
+            score = _jaccard(facts, entry_facts)
+            if score >= min_similarity:
+                scores.append((score, key))
+        # 只读取最相似的结果；它在读取前被其他进程淘汰时依次取下一个
+        for score, key in sorted(scores, key=lambda item: -item[0]):
+            entry = self._load(self.path(key))
+            if entry is not None and entry.get('courses'):
+                return score, entry
+        return 0.0, None
@@ -1,91 +1,19 @@
-import pandas as pd
-
+from cache import ResultCache
+from loader import load_problem
 from TimeTable import plan
 
-# 课时安排
-data = pd.read_excel('./resources/data.xlsx', sheet_name="课时设置", header=1, index_col=0)
-confirm_data = pd.read_excel('./resources/data.xlsx', sheet_name="课程预排")
-no_data = pd.read_excel('./resources/data.xlsx', sheet_name="不排课")
-
-subject_title_list = list(data.columns)
-subject_title_list = [item for item in subject_title_list if not item.startswith('课时')]
-
-teacher_subjects = {}
-for index, row in data.iterrows():
-    for subject in subject_title_list:
-        if pd.isna(row[subject]):
-            continue
-        if row[subject] in teacher_subjects:
-            teacher_subject = teacher_subjects[row[subject]]
-            if subject not in teacher_subject:
-                teacher_subject.append(subject)
-        else:
-            teacher_subjects[row[subject]] = [subject]
-
-subjects_required = {}
-for index, row in data.iterrows():
-    current_index_required = {}
-    for subject in subject_title_list:
-        if pd.isna(row[subject]):
-            continue
-        subject_column_index = data.columns.get_loc(subject)
-        count = data.iloc[data.index.get_loc(index), subject_column_index + 1]
-        current_index_required[subject] = int(count)
-    subjects_required[index] = current_index_required
-
-teacher_required = {}
-for index, row in data.iterrows():
-    current_index_required = {}
-    for subject in subject_title_list:
-        if pd.isna(row[subject]):
-            continue
-        teacher = row[subject]
-        current_index_required[subject] = teacher
-    teacher_required[index] = current_index_required
+# 读取课时设置、课程预排和不排课，同一个文件再次运行时直接使用 .cache 中的快照
+problem = load_problem('./resources/data.xlsx')
 
-grade_teacher = {}
-for index, row in data.iterrows():
-    current_grade_teacher = []
-    for subject in subject_title_list:
-        if pd.isna(row[subject]):
-            continue
-        teacher = row[subject]
-        if teacher not in current_grade_teacher:
-            current_grade_teacher.append(teacher)
-    grade_teacher[index] = current_grade_teacher
+teacher_subjects = problem['teacher_subjects']
+subjects_required = problem['subjects_required']
+teacher_required = problem['teacher_required']
+grade_teacher = problem['grade_teacher']
 
 # 课程预排
-confirm_courses = []
-for index, row in confirm_data.iterrows():
-    for column_index, column in enumerate(confirm_data.items()):
-        if column_index == 0 or pd.isna(row[column[0]]):
-            continue
-        print(f"Row: {index}, Column: {column[0]}, Value: {row[column[0]]}")
-        confirm_course_content = row[column[0]]
-        confirm_course_list = confirm_course_content.splitlines()
-        for confirm_course in confirm_course_list:
-            confirm_course_attr = confirm_course.split('-')
-            confirm_courses.append({'class': confirm_course_attr[0],
-                                    'teacher_name': confirm_course_attr[1],
-                                    'subject': confirm_course_attr[2],
-                                    'week': column_index - 1,
-                                    'sort': index})
+confirm_courses = problem['confirm_courses']
 # 禁止排课
-no_courses = []
-for index, row in no_data.iterrows():
-    for column_index, column in enumerate(no_data.items()):
-        if column_index == 0 or pd.isna(row[column[0]]):
-            continue
-        print(f"Row: {index}, Column: {column[0]}, Value: {row[column[0]]}")
-        no_course_content = row[column[0]]
-        no_course_list = no_course_content.splitlines()
-        for no_course in no_course_list:
-            no_course_attr = no_course.split('-')
-            no_courses.append({'class': no_course_attr[0],
-                                    'teacher_name': no_course_attr[1],
-                                    'subject': no_course_attr[2],
-                                    'week': column_index - 1,
-                                    'sort': index})
+no_courses = problem['no_courses']
 
-# 求解
-plan(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses)
+# 求解；输入与之前某次运行相同（与顺序无关）时直接使用 .cache 中缓存的课表，相近时以缓存的课表为起点
+plan(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses, cache=ResultCache())
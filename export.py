@@ -0,0 +1,117 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+# 星期和课时
+WEEKDAYS = ["周一", "周二", "周三", "周四", "周五", "周六"]
+PERIODS = ["第一节", "第二节", "第三节", "第四节", "第五节", "第六节", "第七节", "第八节", "第九节",]
+
+# 排课结果表的列，与 confirm_courses 中课程字典的键相同
+COLUMNS = ['class', 'week', 'sort', 'subject', 'teacher_name']
+
+
+
+def course_key(course):
+    """课程字典的键 (teacher_name, class, week, sort, subject)，与决策变量 index.x 的键相同"""
+    return (course.get('teacher_name'), course.get('class'), course.get('week'), course.get('sort'),
+            course.get('subject'))
+
+
+# 各导出格式的文件名，{prefix} 替换为文件名前缀
+FILE_NAMES = {
+    'excel': ("{prefix}_班级.xlsx", "{prefix}_教师.xlsx"),
+    'csv': ("{prefix}.csv",),
+    'parquet': ("{prefix}.parquet",),
+}
+
+
+def assignment_table(courses):
+    """把课程列表转成排课结果表：每行一节课，列为 COLUMNS；已经是结果表时原样返回"""
+    if isinstance(courses, pd.DataFrame):
+        return courses
+    return pd.DataFrame(courses, columns=COLUMNS)
+
+
+def table_courses(table):
+    """把排课结果表转回与 confirm_courses 格式相同的课程列表"""
+    return table[COLUMNS].to_dict('records')
+
+
+def _frames(table, owner, label, owners):
+    # 按 owner 分组，用数组下标一次写入整张课表
+    groups = dict(tuple(table.groupby(owner, observed=True, sort=False)))
+    frames = {}
+    for name in owners:
+        cells = np.full((len(PERIODS), len(WEEKDAYS)), np.nan, dtype=object)
+        group = groups.get(name)
+        if group is not None:
+            cells[group['sort'].to_numpy(), group['week'].to_numpy()] = label[group.index].to_numpy()
+        frames[name] = pd.DataFrame(cells, index=PERIODS, columns=WEEKDAYS)
+    return frames
+
+
+def timetable_frames(table, class_list, teacher_list):
+    """把排课结果表整理成每个班级、每个教师一张课表（行为课时，列为星期），返回两组 DataFrame"""
+    table = assignment_table(table).reset_index(drop=True)
+    subject = table['subject'].astype(str)
+    class_label = subject + '（' + table['teacher_name'].astype(str) + '）'
+    teacher_label = subject + '（' + table['class'].astype(str) + '）'
+    return (_frames(table, 'class', class_label, class_list),
+            _frames(table, 'teacher_name', teacher_label, teacher_list))
+
+
+def write_excel(table, class_list, teacher_list, class_path, teacher_path):
+    """导出 Excel：班级课表和教师课表各一个文件，每张课表一个 sheet"""
+    df_class_dict, df_teacher_dict = timetable_frames(table, class_list, teacher_list)
+    with pd.ExcelWriter(class_path) as writer:
+        for class_, df in df_class_dict.items():
+            df.to_excel(writer, sheet_name=class_)
+    with pd.ExcelWriter(teacher_path) as writer:
+        for teacher, df in df_teacher_dict.items():
+            df.to_excel(writer, sheet_name=teacher)
+    return df_class_dict, df_teacher_dict
+
+
+def write_csv(table, path):
+    """导出 CSV：每行一节课，列为 COLUMNS；带 BOM，Excel 可以直接打开中文"""
+    assignment_table(table)[COLUMNS].to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def write_parquet(table, path):
+    """导出 Parquet：每行一节课，列为 COLUMNS；需要安装 pyarrow 或 fastparquet"""
+    assignment_table(table)[COLUMNS].to_parquet(path, index=False)
+
+
+def check_formats(formats):
+    """检查导出格式：不支持的格式，或 parquet 缺少 pyarrow、fastparquet 时抛出 ValueError
+
+    求解前调用，避免求解结束后才在导出时出错而丢失课表。
+    """
+    for format_ in formats:
+        if format_ not in FILE_NAMES:
+            raise ValueError(f"不支持的导出格式：{format_}，可选 {list(FILE_NAMES)}")
+    if 'parquet' in formats and not any(importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')):
+        raise ValueError("导出 parquet 需要安装 pyarrow 或 fastparquet")
+
+
+def export_timetable(courses, class_list, teacher_list, output_dir='.', formats=('excel',), prefix="排课结果"):
+    """导出排课结果，返回 {格式: 文件路径列表}
+
+    courses 为课程列表或排课结果表；formats 为 FILE_NAMES 中的格式，
+    文件写到 output_dir 下，文件名为 FILE_NAMES 中的模板，例如 排课结果_班级.xlsx、排课结果.csv。
+    """
+    check_formats(formats)
+    table = assignment_table(courses)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for format_ in formats:
+        paths[format_] = [os.path.join(output_dir, name.format(prefix=prefix)) for name in FILE_NAMES[format_]]
+        if format_ == 'excel':
+            write_excel(table, class_list, teacher_list, *paths[format_])
+        elif format_ == 'csv':
+            write_csv(table, *paths[format_])
+        else:
+            write_parquet(table, *paths[format_])
+    return paths
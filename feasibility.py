@@ -0,0 +1,182 @@
+import numbers
+from collections import defaultdict
+
+from export import PERIODS, WEEKDAYS, course_key
+from rules import DEFAULT_RULES, allowed_slots, check_rules, find_rule, time_grid
+
+
+def _is_index(value):
+    # 整数时段，包括 numpy 整数（与 int 的哈希和比较相同），不包括 bool
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def _where(kind, course):
+    return f"{kind}：{course.get('class')}-{course.get('teacher_name')}-{course.get('subject')}"
+
+
+def _slot_name(day, period):
+    return f"{WEEKDAYS[day]}{PERIODS[period]}"
+
+
+def check_feasibility(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+                      fixed_courses=[], rules=None):
+    """建模前的计数检查：逐条检查有解的必要条件，返回全部违反条件的说明
+
+    只做计数，不建模，毫秒级完成；返回空列表不代表一定有解，这时可以用 TimeTable.infeasible_core() 进一步定位。
+    参数与 build_model() 相同，必要条件按规则集 rules 中启用的硬约束计算。
+    """
+    rules = rules or DEFAULT_RULES
+    check_rules(rules)
+    days, periods = time_grid(rules)
+    mandatory = find_rule(rules, 'mandatory_periods')
+    mandatory_periods = [period for period in mandatory['periods'] if period < periods] if mandatory else []
+    daily_hours = find_rule(rules, 'daily_hours')
+    double_lesson = find_rule(rules, 'double_lesson')
+    split = tuple(double_lesson['split']) if double_lesson else None
+
+    errors = []
+    no_course_keys = {course_key(course) for course in no_courses}
+    busy_teacher_slots = defaultdict(set)
+    for course in fixed_courses:
+        busy_teacher_slots[course['teacher_name']].add((course['week'], course['sort']))
+
+    # 班级每门课程可以任课的教师，与 build_model() 创建变量的条件相同
+    candidates = {}
+    for class_, required in subjects_required.items():
+        class_teachers = [teacher for teacher in dict.fromkeys(teacher_required.get(class_, {}).values())
+                          if teacher in teacher_subjects]
+        for subject in required:
+            candidates[class_, subject] = [teacher for teacher in class_teachers
+                                           if subject in teacher_subjects[teacher]]
+
+    subject_slots = {}
+    for required in subjects_required.values():
+        for subject in required:
+            if subject not in subject_slots:
+                subject_slots[subject] = set(allowed_slots(rules, subject))
+
+    def allowed(teacher, class_, day, period, subject):
+        return ((day, period) in subject_slots[subject]
+                and (teacher, class_, day, period, subject) not in no_course_keys
+                and (day, period) not in busy_teacher_slots[teacher])
+
+    # 班级：总课时数、每门课程的可排课时、必排时段
+    teacher_load = defaultdict(int)
+    for class_, required in subjects_required.items():
+        total = sum(required.values())
+        if total < len(mandatory_periods) * days:
+            errors.append(f"班级 {class_}：每周 {total} 课时，少于每天"
+                          f"{'、'.join(PERIODS[period] for period in mandatory_periods)}必排的 "
+                          f"{len(mandatory_periods) * days} 课时")
+        if total > days * periods:
+            errors.append(f"班级 {class_}：每周 {total} 课时，超过 {days} 天 × {periods} 节 = {days * periods} 个时段")
+
+        filled = [[False] * periods for _ in range(days)]
+        for subject, hours in required.items():
+            teachers = candidates[class_, subject]
+            if hours <= 0:
+                continue
+            if not teachers:
+                errors.append(f"班级 {class_}：{subject} 每周 {hours} 课时，但没有能教这门课的任课教师")
+                continue
+            # 只有一名教师能教时，这些课时一定由他承担
+            if len(teachers) == 1:
+                teacher_load[teachers[0]] += hours
+
+            # daily 为 True 时每天都要上，每天最多 limit 节；没有 daily_hours 规则时不限制每天的节数
+            daily = daily_hours is not None and hours > daily_hours['threshold']
+            limit = (2 if daily else 1) if daily_hours is not None else periods
+            capacity = 0
+            for day in range(days):
+                available = [any(allowed(teacher, class_, day, period, subject) for teacher in teachers)
+                             for period in range(periods)]
+                for period in range(periods):
+                    filled[day][period] = filled[day][period] or available[period]
+                if not any(available):
+                    if daily:
+                        errors.append(f"班级 {class_}：{subject} 每周 {hours} 课时，每天都要上，"
+                                      f"但{WEEKDAYS[day]}没有可排的课时")
+                    continue
+                # 有 double_lesson 规则时当天的多节课必须连堂，且不能跨 split 这两节
+                if double_lesson is None:
+                    capacity += min(limit, sum(available))
+                else:
+                    run = longest = 0
+                    for period in range(periods):
+                        if not available[period]:
+                            run = 0
+                        elif period > 0 and available[period - 1] and (period - 1, period) != split:
+                            run += 1
+                        else:
+                            run = 1
+                        longest = max(longest, run)
+                    capacity += min(limit, longest)
+            if capacity < hours:
+                errors.append(f"班级 {class_}：{subject} 每周 {hours} 课时，按每天的节数限制、连堂规则"
+                              f"和可排时段计算最多只能排 {capacity} 课时")
+
+        for day in range(days):
+            for period in mandatory_periods:
+                if not filled[day][period]:
+                    errors.append(f"班级 {class_}：{_slot_name(day, period)}必须排课，但没有可以排在这个时段的课程")
+
+    # 教师：必须由他承担的课时不能超过空闲时段
+    for teacher, load in teacher_load.items():
+        free = days * periods - len(busy_teacher_slots[teacher])
+        if load > free:
+            errors.append(f"教师 {teacher}：所任班级合计每周 {load} 课时，超过可用的 {free} 个时段")
+
+    # 预排：与不排课、允许的组合和彼此之间是否冲突
+    class_slots = {}
+    teacher_slots = {}
+    confirm_count = defaultdict(int)
+    confirm_days = defaultdict(list)
+    confirm_keys = set()
+    for course in confirm_courses:
+        key = course_key(course)
+        teacher, class_, day, period, subject = key
+        where = _where("课程预排", course)
+        if not (_is_index(day) and 0 <= day < days and _is_index(period) and 0 <= period < periods):
+            errors.append(f"{where} 时段超出 {days} 天 × {periods} 节")
+            continue
+        # 重复的预排只算一次
+        if key in confirm_keys:
+            continue
+        confirm_keys.add(key)
+        where = f"{where}（{_slot_name(day, period)}）"
+        if key in no_course_keys:
+            errors.append(f"{where} 与不排课冲突")
+        elif subject not in subjects_required.get(class_, {}):
+            errors.append(f"{where} 该班级没有这门课程")
+        elif teacher not in candidates[class_, subject]:
+            errors.append(f"{where} 教师不是该班级这门课程的任课教师")
+        elif (day, period) not in subject_slots[subject]:
+            errors.append(f"{where} 这门课程不能排在这个时段")
+        elif (day, period) in busy_teacher_slots[teacher]:
+            errors.append(f"{where} 教师这个时段已有其他班级的课")
+
+        other = class_slots.setdefault((class_, day, period), course)
+        if other is not course:
+            errors.append(f"{where} 与 {other['teacher_name']}-{other['subject']} 预排在同一时段")
+        other = teacher_slots.setdefault((teacher, day, period), course)
+        if other is not course and other['class'] != class_:
+            errors.append(f"{where} 教师同一时段还预排在 {other['class']}")
+        confirm_count[class_, subject] += 1
+        confirm_days[class_, subject, day].append(period)
+
+    for (class_, subject), count in confirm_count.items():
+        hours = subjects_required.get(class_, {}).get(subject, 0)
+        if count > hours:
+            errors.append(f"课程预排：{class_} 的 {subject} 预排了 {count} 节，超过每周 {hours} 课时")
+    for (class_, subject, day), day_periods in confirm_days.items():
+        day_periods = sorted(set(day_periods))
+        hours = subjects_required.get(class_, {}).get(subject, 0)
+        limit = (2 if hours > daily_hours['threshold'] else 1) if daily_hours is not None else periods
+        if len(day_periods) > limit:
+            errors.append(f"课程预排：{class_} 的 {subject} {WEEKDAYS[day]}预排了 {len(day_periods)} 节，"
+                          f"超过每天最多 {limit} 节")
+        elif double_lesson is not None and any(second - first != 1 or (first, second) == split
+                                               for first, second in zip(day_periods, day_periods[1:])):
+            errors.append(f"课程预排：{class_} 的 {subject} {WEEKDAYS[day]}预排的"
+                          f"{'、'.join(PERIODS[period] for period in day_periods)}不是允许的连堂")
+    return errors
@@ -0,0 +1,106 @@
+import random
+
+# 每个班级每门课程的周课时数，参考 resources/data.xlsx 中高一年级的设置
+SUBJECT_HOURS = {
+    '语文': 8, '数学': 8, '英语': 8, '物理': 7, '化学': 7, '生物': 6,
+    '政治': 1, '历史': 1, '地理': 2, '体育': 2, '信息技术': 1, '音乐': 1,
+}
+
+# 文科班的周课时数，参考 resources/data.xlsx 中高二2班、高二3班的设置
+ARTS_SUBJECT_HOURS = {
+    '语文': 8, '数学': 8, '英语': 8, '物理': 2, '政治': 7, '历史': 8,
+    '地理': 8, '体育': 2, '信息技术': 2,
+}
+
+# 每门课程一名教师最多带几个班
+CLASSES_PER_TEACHER = {
+    '语文': 2, '数学': 2, '英语': 2, '物理': 2, '化学': 2, '生物': 2,
+    '政治': 6, '历史': 6, '地理': 4, '体育': 4, '信息技术': 8, '音乐': 8,
+}
+
+# 每个年级的班级数
+CLASSES_PER_GRADE = 8
+
+
+def generate_school(class_count, seed=0, classes_per_grade=CLASSES_PER_GRADE, arts_ratio=0.25,
+                    confirm_count=0, no_course_count=0):
+    """生成一个有 class_count 个班级的合成学校，返回 plan() 所需的输入
+
+    班级按年级分组，第一个年级全部是理科班，其余年级中约 arts_ratio 的班级为文科班；
+    教师只在本年级内带班。confirm_count、no_course_count 分别为随机生成的预排和禁止排课条数。
+    相同的参数和 seed 总是生成相同的输入。
+    """
+    rng = random.Random(seed)
+
+    class_list = []
+    subjects_required = {}
+    for index in range(class_count):
+        grade, number = divmod(index, classes_per_grade)
+        class_ = f"{grade + 1}年级{number + 1}班"
+        class_list.append(class_)
+        if grade > 0 and rng.random() < arts_ratio:
+            subjects_required[class_] = dict(ARTS_SUBJECT_HOURS)
+        else:
+            subjects_required[class_] = dict(SUBJECT_HOURS)
+
+    # 同一年级开设同一课程的班级随机分组，每组分配一名教师
+    teacher_subjects = {}
+    teacher_required = {class_: {} for class_ in class_list}
+    for grade_start in range(0, class_count, classes_per_grade):
+        grade_classes = class_list[grade_start:grade_start + classes_per_grade]
+        for subject, per_teacher in CLASSES_PER_TEACHER.items():
+            subject_classes = [class_ for class_ in grade_classes if subject in subjects_required[class_]]
+            rng.shuffle(subject_classes)
+            for group_start in range(0, len(subject_classes), per_teacher):
+                teacher = f"{subject}教师{len(teacher_subjects) + 1}"
+                teacher_subjects[teacher] = [subject]
+                for class_ in subject_classes[group_start:group_start + per_teacher]:
+                    teacher_required[class_][subject] = teacher
+
+    confirm_courses = _random_courses(rng, confirm_count, class_list, teacher_required, set(), subjects_required)
+    used_slots = {(course['class'], course['week'], course['sort']) for course in confirm_courses}
+    no_courses = _random_courses(rng, no_course_count, class_list, teacher_required, used_slots)
+
+    return {
+        'teacher_subjects': teacher_subjects,
+        'subjects_required': subjects_required,
+        'teacher_required': teacher_required,
+        'confirm_courses': confirm_courses,
+        'no_courses': no_courses,
+    }
+
+
+def _random_courses(rng, count, class_list, teacher_required, used_slots, subjects_required=None):
+    # 随机挑选互不冲突的（班级、教师、课程、时段），格式与 demo.py 读取的预排/不排课一致
+    # 传入 subjects_required 时，同一班级同一课程挑选的条数不超过其周课时数
+    courses = []
+    used_teacher_slots = set()
+    used_days = set()
+    attempts = 0
+    while len(courses) < count and attempts < count * 100:
+        attempts += 1
+        class_ = rng.choice(class_list)
+        subject, teacher = rng.choice(list(teacher_required[class_].items()))
+        day = rng.randrange(6)
+        period = rng.randrange(9)
+        # 体育课只能排在周 456 的第三节及以后
+        if subject == '体育' and (day < 3 or period < 2):
+            continue
+        if (class_, day, period) in used_slots or (teacher, day, period) in used_teacher_slots:
+            continue
+        # 同一班级同一课程每天最多预排一节，避免与每天课时数的限制冲突
+        if (class_, subject, day) in used_days:
+            continue
+        if subjects_required is not None:
+            picked = sum(1 for course in courses if course['class'] == class_ and course['subject'] == subject)
+            if picked >= subjects_required[class_][subject]:
+                continue
+        used_slots.add((class_, day, period))
+        used_teacher_slots.add((teacher, day, period))
+        used_days.add((class_, subject, day))
+        courses.append({'class': class_,
+                        'teacher_name': teacher,
+                        'subject': subject,
+                        'week': day,
+                        'sort': period})
+    return courses
@@ -0,0 +1,157 @@
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ortools.sat.python import cp_model
+
+from export import check_formats, course_key, export_timetable, table_courses
+from rules import DEFAULT_RULES, time_grid
+from TimeTable import build_model, extract_assignments
+
+# 工作进程中的模型，由 _init_worker 建好后复用
+_model = None
+_index = None
+
+
+def _init_worker(inputs):
+    global _model, _index
+    _model, _index = build_model(**inputs)
+
+
+def _solve_neighbourhood(courses, free_classes, free_days, time_limit, seed, stop_at_first_solution=False,
+                         search_workers=1):
+    """固定 courses 中不属于邻域的课程，重新求解邻域，返回求解状态、目标值和新的课程列表
+
+    free_classes / free_days 为 None 表示不按该维度限制；两者都为 None 时整个模型都是自由的。
+    """
+    model = _model.clone()
+    scheduled = {course_key(course) for course in courses}
+    whole_model = free_classes is None and free_days is None
+    for key, course in _index.x.items():
+        value = 1 if key in scheduled else 0
+        free = whole_model or ((free_classes is None or key[1] in free_classes)
+                               and (free_days is None or key[2] in free_days))
+        if not free:
+            model.Add(course == value)
+        elif courses:
+            model.AddHint(course, value)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    # 进程池已经并行，子问题默认只用一个线程
+    solver.parameters.num_search_workers = search_workers
+    solver.parameters.random_seed = seed
+    if stop_at_first_solution:
+        solver.parameters.stop_after_first_solution = True
+    status = solver.Solve(model)
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        return status, None, None
+
+    return status, solver.ObjectiveValue(), table_courses(extract_assignments(solver, _index))
+
+
+def grade_of(class_):
+    """班级所在的年级：去掉班级名末尾的“N班”，例如 高一3班 -> 高一"""
+    return re.sub(r'\d+班$', '', class_)
+
+
+def random_neighbourhood(rng, teacher_required, neighbourhood_size, days=6):
+    """随机选择一个邻域，返回（描述，自由班级，自由的天）
+
+    邻域有三种：一个年级的全部班级；从一名教师出发，沿共同任课教师扩展到 neighbourhood_size 个班级；某一天的全部课程。
+    """
+    class_list = list(teacher_required.keys())
+    kind = rng.choice(['grade', 'teachers', 'day'])
+    if kind == 'grade':
+        grade = grade_of(rng.choice(class_list))
+        return f"年级 {grade}", {class_ for class_ in class_list if grade_of(class_) == grade}, None
+    if kind == 'teachers':
+        teacher = rng.choice([teacher for class_ in class_list for teacher in teacher_required[class_].values()])
+        classes = set()
+        frontier = [teacher]
+        while frontier and len(classes) < neighbourhood_size:
+            teacher = frontier.pop(0)
+            for class_ in class_list:
+                if class_ not in classes and teacher in teacher_required[class_].values():
+                    classes.add(class_)
+                    frontier.extend(teacher_required[class_].values())
+                    if len(classes) >= neighbourhood_size:
+                        break
+        return f"教师组 {sorted(classes)}", classes, None
+    day = rng.randrange(days)
+    return f"第 {day + 1} 天", None, {day}
+
+
+def lns(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+        initial=None, time_limit=600, sub_time_limit=30, workers=None, neighbourhood_size=4, seed=0,
+        log_path=None, output_dir='.', formats=('excel',), rules=None, weights=None):
+    """大邻域搜索：先得到一个可行课表，再反复释放一个邻域（年级、共享班级的教师组或某一天），
+    固定其余课程重新求解，多个邻域在进程池中并行求解，取其中最好的改进
+
+    initial 为初始课表（例如上一次的排课结果），为 None 时先求第一个可行解。
+    返回最好的课程列表和改进记录 [(耗时, 目标值, 邻域描述)]，并导出 Excel；没有可行解时课程列表为 None。
+    log_path 不为空时把改进记录写成 JSON；结果按 formats 导出到 output_dir，见 export_timetable()。
+    rules、weights 为规则集和软约束权重，见 build_model()。
+    """
+    check_formats(formats)
+    inputs = {
+        'teacher_subjects': teacher_subjects,
+        'subjects_required': subjects_required,
+        'teacher_required': teacher_required,
+        'confirm_courses': confirm_courses,
+        'no_courses': no_courses,
+        'rules': rules,
+        'weights': weights,
+    }
+    days = time_grid(rules or DEFAULT_RULES)[0]
+    workers = workers or os.cpu_count()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    log = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(inputs,)) as pool:
+        # 初始可行解：没有给出时直接求第一个可行解，给出时只计算它的目标值
+        # 求第一个可行解时进程池中没有其他任务，使用 CP-SAT 的多线程组合搜索，至少 8 个线程
+        if initial is None:
+            first = pool.submit(_solve_neighbourhood, [], None, None, time_limit, seed, True, max(workers, 8))
+        else:
+            first = pool.submit(_solve_neighbourhood, initial, set(), None, time_limit, seed)
+        status, objective, courses = first.result()
+        if courses is None:
+            print("No feasible solution found.")
+            return None, log
+        log.append((round(time.perf_counter() - start, 3), objective, "初始解"))
+        print(f"{log[-1][0]}s 初始解 {objective}")
+
+        round_ = 0
+        while objective > 0:
+            remaining = time_limit - (time.perf_counter() - start)
+            if remaining <= 1:
+                break
+            round_ += 1
+            futures = []
+            for worker in range(workers):
+                name, free_classes, free_days = random_neighbourhood(rng, teacher_required, neighbourhood_size, days)
+                future = pool.submit(_solve_neighbourhood, courses, free_classes, free_days,
+                                     min(sub_time_limit, remaining), seed + round_ * workers + worker)
+                futures.append((name, future))
+
+            # 各邻域都是从同一个课表出发求解的，只采用其中最好的一个
+            best = None
+            for name, future in futures:
+                status, sub_objective, sub_courses = future.result()
+                if sub_courses is not None and sub_objective < objective and (best is None or sub_objective < best[0]):
+                    best = (sub_objective, sub_courses, name)
+            if best is not None:
+                objective, courses, name = best
+                log.append((round(time.perf_counter() - start, 3), objective, name))
+                print(f"{log[-1][0]}s {name} {objective}")
+
+    if log_path:
+        with open(log_path, 'w', encoding='utf-8') as f:
+            json.dump(log, f, ensure_ascii=False, indent=2)
+    export_timetable(courses, list(subjects_required.keys()), list(teacher_subjects.keys()), output_dir, formats)
+    return courses, log
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# 快照格式变化时修改版本号，旧快照会自动失效
+SNAPSHOT_VERSION = 1
+
+
+def _parse_courses(df, kind, errors):
+    # 课程预排 / 不排课：第一行为星期，第一列为课时，单元格每行一条“班级-教师-课程”
+    courses = []
+    for row_index in range(1, len(df)):
+        for column_index in range(1, df.shape[1]):
+            cell = df.iat[row_index, column_index]
+            if pd.isna(cell):
+                continue
+            for line in str(cell).splitlines():
+                attr = line.split('-')
+                if len(attr) != 3:
+                    errors.append(f"{kind}（{df.iat[0, column_index]} 第{row_index}行）格式应为 班级-教师-课程：{line}")
+                    continue
+                courses.append({'class': attr[0],
+                                'teacher_name': attr[1],
+                                'subject': attr[2],
+                                'week': column_index - 1,
+                                'sort': row_index - 1})
+    return courses
+
+
+def read_workbook(path):
+    """一次读取排课 Excel 的全部 sheet，一遍构建 demo.py 所需的全部输入，返回（输入，错误列表）"""
+    sheets = pd.read_excel(path, sheet_name=None, header=None)
+    errors = []
+
+    # 课时设置：第二行为表头（年级、课程、课时、课程、课时……），之后每行一个班级
+    data = sheets['课时设置']
+    header = list(data.iloc[1])
+    subject_columns = [(column, header[column]) for column in range(1, len(header))
+                       if not pd.isna(header[column]) and not str(header[column]).startswith('课时')]
+
+    teacher_subjects = {}
+    subjects_required = {}
+    teacher_required = {}
+    grade_teacher = {}
+    for row in data.iloc[2:].itertuples(index=False):
+        class_ = row[0]
+        if pd.isna(class_):
+            continue
+        current_subjects_required = {}
+        current_teacher_required = {}
+        current_grade_teacher = []
+        for column, subject in subject_columns:
+            teacher = row[column]
+            if pd.isna(teacher):
+                continue
+            count = row[column + 1] if column + 1 < len(row) else None
+            if pd.isna(count):
+                errors.append(f"课时设置：{class_} 的 {subject} 没有填写课时数")
+                continue
+            current_subjects_required[subject] = int(count)
+            current_teacher_required[subject] = teacher
+            if teacher not in current_grade_teacher:
+                current_grade_teacher.append(teacher)
+            teacher_subject = teacher_subjects.setdefault(teacher, [])
+            if subject not in teacher_subject:
+                teacher_subject.append(subject)
+        subjects_required[class_] = current_subjects_required
+        teacher_required[class_] = current_teacher_required
+        grade_teacher[class_] = current_grade_teacher
+
+    problem = {
+        'teacher_subjects': teacher_subjects,
+        'subjects_required': subjects_required,
+        'teacher_required': teacher_required,
+        'grade_teacher': grade_teacher,
+        'confirm_courses': _parse_courses(sheets['课程预排'], '课程预排', errors),
+        'no_courses': _parse_courses(sheets['不排课'], '不排课', errors),
+    }
+    return problem, errors
+
+
+def validate_problem(problem):
+    """检查预排和不排课引用的班级、教师和课程是否存在，返回错误列表
+
+    只检查引用；时段是否在时间网格内、教师是否任课等与规则集有关的检查由 feasibility.check_feasibility() 完成。
+    """
+    errors = []
+    teacher_required = problem['teacher_required']
+    for kind, courses in (('课程预排', problem['confirm_courses']), ('不排课', problem['no_courses'])):
+        for course in courses:
+            class_ = course['class']
+            teacher = course['teacher_name']
+            subject = course['subject']
+            where = f"{kind}：{class_}-{teacher}-{subject}"
+            if class_ not in teacher_required:
+                errors.append(f"{where} 班级不存在")
+            elif teacher not in problem['teacher_subjects']:
+                errors.append(f"{where} 教师不存在")
+            elif subject not in problem['subjects_required'][class_]:
+                errors.append(f"{where} 该班级没有这门课程")
+    return errors
+
+
+def workbook_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_problem(path, cache_dir='.cache'):
+    """读取排课 Excel 并校验，结果按文件内容的哈希保存为 JSON 快照
+
+    同一个文件再次读取时直接使用快照，不再解析 Excel；cache_dir 为 None 时不使用快照。
+    输入有错误时抛出 ValueError，列出全部错误。
+    """
+    snapshot_path = None
+    if cache_dir is not None:
+        snapshot_path = os.path.join(cache_dir, f"problem-v{SNAPSHOT_VERSION}-{workbook_hash(path)}.json")
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding='utf-8') as f:
+                return json.load(f)
+
+    problem, errors = read_workbook(path)
+    errors.extend(validate_problem(problem))
+    if errors:
+        raise ValueError(f"{path} 有 {len(errors)} 处错误：\n" + "\n".join(errors))
+
+    if snapshot_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(snapshot_path, 'w', encoding='utf-8') as f:
+            json.dump(problem, f, ensure_ascii=False, separators=(',', ':'))
+    return problem
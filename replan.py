@@ -0,0 +1,145 @@
+from ortools.sat.python import cp_model
+
+from export import check_formats, course_key, export_timetable
+from feasibility import check_feasibility
+from rules import DEFAULT_RULES, allowed_slots
+from TimeTable import add_hints, build_model, solve_model
+
+
+def affected_classes(previous, teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[],
+                     no_courses=[], changed_classes=(), changed_teachers=(), rules=None):
+    """找出已有课表 previous 在新输入下需要重排的班级
+
+    以下班级需要重排：新增的班级；课程、教师或课时数与新输入不一致的班级；
+    课程落在禁止排课时段或规则集 rules（默认为 rules.DEFAULT_RULES）不允许的时段上、或预排课程不在原课表中的班级；
+    以及变更集中显式给出的班级 changed_classes 和教师 changed_teachers 所带的班级。
+    """
+    rules = rules or DEFAULT_RULES
+    subject_slots = {}
+    affected = set(changed_classes)
+    changed_teachers = set(changed_teachers)
+    for class_, class_teachers in teacher_required.items():
+        if changed_teachers.intersection(class_teachers.values()):
+            affected.add(class_)
+
+    # 统计原课表每个班级每门课程的课时数
+    previous_counts = {}
+    for course in previous:
+        class_ = course['class']
+        if class_ not in subjects_required:
+            continue
+        counts = previous_counts.setdefault(class_, {})
+        counts[course['subject']] = counts.get(course['subject'], 0) + 1
+        # 教师不再带这个班，或不再教授这门课
+        teacher = course['teacher_name']
+        if (teacher not in teacher_subjects
+                or teacher not in teacher_required.get(class_, {}).values()
+                or course['subject'] not in teacher_subjects[teacher]):
+            affected.add(class_)
+        subject = course['subject']
+        if subject not in subject_slots:
+            subject_slots[subject] = set(allowed_slots(rules, subject))
+        if (course['week'], course['sort']) not in subject_slots[subject]:
+            affected.add(class_)
+
+    for class_, subject_required in subjects_required.items():
+        required = {subject: count for subject, count in subject_required.items() if count > 0}
+        if previous_counts.get(class_) != required:
+            affected.add(class_)
+
+    previous_keys = {course_key(course) for course in previous}
+    for no_course in no_courses:
+        if course_key(no_course) in previous_keys:
+            affected.add(no_course['class'])
+    for confirm_course in confirm_courses:
+        if course_key(confirm_course) not in previous_keys:
+            affected.add(confirm_course['class'])
+
+    return affected & set(subjects_required)
+
+
+def neighbourhood(classes, teacher_required, depth=1):
+    """沿共同的任课教师扩展班级集合 depth 层，返回扩展后的班级和这些班级的教师"""
+    classes = set(classes)
+    for _ in range(depth):
+        teachers = {teacher for class_ in classes for teacher in teacher_required.get(class_, {}).values()}
+        classes |= {class_ for class_, class_teachers in teacher_required.items()
+                    if teachers.intersection(class_teachers.values())}
+    teachers = {teacher for class_ in classes for teacher in teacher_required.get(class_, {}).values()}
+    return classes, teachers
+
+
+def replan(previous, teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+           changed_classes=(), changed_teachers=(), depth=0, stop_at_first_solution=False, relative_gap=None,
+           time_limit=600, output_dir='.', formats=('excel',), rules=None, weights=None):
+    """在已有课表 previous 的基础上增量重排
+
+    只重排受变更影响的班级，以及沿共同任课教师扩展 depth 层得到的班级，
+    其余班级的课程保持不变，作为占用教师时段的常量参与建模；子问题无解时自动再扩展一层重试，
+    扩展不到新的班级时停止。
+    返回合并后的完整课程列表并按 formats 导出到 output_dir，与 plan() 相同；没有需要重排的班级时直接导出原课表，无解时返回 None。
+    新输入本身不可能有解时（check_feasibility() 的计数检查）抛出 ValueError，列出全部问题。
+    rules、weights 为规则集和软约束权重，应与排出 previous 时相同，见 build_model()。
+    """
+    check_formats(formats)
+    affected = affected_classes(previous, teacher_subjects, subjects_required, teacher_required, confirm_courses,
+                                no_courses, changed_classes, changed_teachers, rules)
+    class_list = list(subjects_required.keys())
+    teacher_list = list(teacher_subjects.keys())
+    if not affected:
+        print("没有需要重排的班级")
+        courses = [course for course in previous if course['class'] in subjects_required]
+        export_timetable(courses, class_list, teacher_list, output_dir, formats)
+        return courses
+
+    errors = check_feasibility(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses,
+                               rules=rules)
+    if errors:
+        raise ValueError(f"输入不可能有解，有 {len(errors)} 处问题：\n" + "\n".join(errors))
+
+    previous_classes = None
+    while True:
+        free_classes, free_teachers = neighbourhood(affected, teacher_required, depth)
+        if free_classes == previous_classes:
+            # 受影响的班级与其余班级没有共同的教师，扩大范围也不会变化
+            print("扩展不到新的班级，无解")
+            return None
+        previous_classes = free_classes
+        print(f"重排 {len(free_classes)}/{len(class_list)} 个班级：{sorted(free_classes)}")
+
+        # 子问题只包含需要重排的班级和它们的教师
+        sub_teacher_subjects = {teacher: subjects for teacher, subjects in teacher_subjects.items()
+                                if teacher in free_teachers}
+        sub_subjects_required = {class_: subjects_required[class_] for class_ in class_list if class_ in free_classes}
+        sub_teacher_required = {class_: teacher_required.get(class_, {}) for class_ in sub_subjects_required}
+        sub_confirm_courses = [course for course in confirm_courses if course['class'] in free_classes]
+        sub_no_courses = [course for course in no_courses if course['class'] in free_classes]
+
+        # 其余班级的课程保持不变
+        kept_courses = [course for course in previous
+                        if course['class'] in subjects_required and course['class'] not in free_classes]
+        fixed_courses = [course for course in kept_courses if course['teacher_name'] in free_teachers]
+
+        # 固定的课程占用了教师的时段，计数检查即可看出子问题无解时不再建模，直接扩大重排范围
+        if check_feasibility(sub_teacher_subjects, sub_subjects_required, sub_teacher_required, sub_confirm_courses,
+                             sub_no_courses, fixed_courses, rules):
+            if len(free_classes) == len(class_list):
+                return None
+            depth += 1
+            continue
+
+        model, index = build_model(sub_teacher_subjects, sub_subjects_required, sub_teacher_required,
+                                   sub_confirm_courses, sub_no_courses, fixed_courses, weights=weights, rules=rules)
+        add_hints(model, index, [course for course in previous if course['class'] in free_classes])
+
+        status, courses = solve_model(model, index, time_limit, stop_at_first_solution, relative_gap)
+        if courses is not None:
+            break
+        # 固定的课程使子问题无解，扩大重排范围
+        if status != cp_model.INFEASIBLE or len(free_classes) == len(class_list):
+            return None
+        depth += 1
+
+    courses = kept_courses + courses
+    export_timetable(courses, class_list, teacher_list, output_dir, formats)
+    return courses
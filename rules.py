@@ -0,0 +1,425 @@
+import copy
+import json
+from collections import defaultdict
+
+from ortools.sat.python import cp_model
+
+from export import PERIODS, WEEKDAYS
+
+# 默认规则集：时间网格、硬约束和带权重的软约束（目标函数）
+# 每条规则是一个字典：type 为规则类型（见 HARD_RULES / SOFT_RULES），name 用于遥测记录和 weights 覆盖权重，
+# enabled 为 False 时跳过该规则，其余键为规则参数；课时数、教师/班级时段冲突、预排和不排课始终生效，不在规则集中
+DEFAULT_RULES = {
+    # 每周天数、每天课时数，前 morning_periods 节为上午
+    'days': 6,
+    'periods': 9,
+    'morning_periods': 5,
+    'hard': [
+        # 体育课只能排在周四至周六，且不能排在上午前两节
+        {'type': 'slot_window', 'name': 'pe_window', 'subjects': ['体育'],
+         'days': [3, 4, 5], 'periods': [2, 3, 4, 5, 6, 7, 8]},
+        # 每天的第一节、第二节和第六节必须排课
+        {'type': 'mandatory_periods', 'name': 'mandatory_periods', 'periods': [0, 1, 5]},
+        # 每周课时数大于 threshold 的课程每天 1-2 节，否则每天最多 1 节
+        {'type': 'daily_hours', 'name': 'daily_hours', 'threshold': 6},
+        # 当天两节课必须连堂，且不能是 split 这两节（第五节和第六节）
+        {'type': 'double_lesson', 'name': 'double_lesson', 'split': [4, 5]},
+    ],
+    'soft': [
+        # 教师当天的课程尽量全部在上午或全部在下午
+        {'type': 'time_block', 'name': 'time_block', 'weight': 1},
+        # 周1、3、5语文尽量靠前，周2、4、6英语尽量靠前，排在第 period 节的代价为 period
+        {'type': 'early_periods', 'name': 'subject_time', 'weight': 100,
+         'subjects': {'语文': [0, 2, 4], '英语': [1, 3, 5]}},
+        # 尽量避免在周六排连堂
+        {'type': 'day_double_lesson', 'name': 'saturday', 'weight': 10, 'day': 5},
+    ],
+}
+
+# 可选的冗余约束和对称性破除，用 with_symmetry_breaking() 追加到规则集中
+SYMMETRY_RULES = [
+    # 教师每周总课时数
+    {'type': 'teacher_load', 'name': 'teacher_load'},
+    # 班级每天课时数的上下限
+    {'type': 'class_daily_count', 'name': 'class_daily_count'},
+    # 完全等价的班级按前 slots 节的课程排序
+    {'type': 'class_symmetry', 'name': 'class_symmetry', 'slots': 3},
+    # 规则相同的天按前 classes 个班级第一节的课程排序
+    {'type': 'day_symmetry', 'name': 'day_symmetry', 'classes': 3},
+]
+
+
+def load_rules(path):
+    """从 JSON 文件读取规则集，格式与 DEFAULT_RULES 相同，缺少的键取 DEFAULT_RULES 中的值"""
+    with open(path, encoding='utf-8') as f:
+        return {**copy.deepcopy(DEFAULT_RULES), **json.load(f)}
+
+
+def with_symmetry_breaking(rules=None):
+    """返回在 rules（默认为 DEFAULT_RULES）的硬约束之后追加 SYMMETRY_RULES 的新规则集"""
+    rules = copy.deepcopy(rules or DEFAULT_RULES)
+    rules['hard'] = rules['hard'] + copy.deepcopy(SYMMETRY_RULES)
+    return rules
+
+
+def enabled_rules(rules, kind):
+    return [rule for rule in rules[kind] if rule.get('enabled', True)]
+
+
+def find_rule(rules, type_):
+    """规则集中第一条启用的 type_ 硬约束，没有时返回 None"""
+    for rule in enabled_rules(rules, 'hard'):
+        if rule['type'] == type_:
+            return rule
+    return None
+
+
+def time_grid(rules):
+    """规则集的时间网格（每周天数，每天课时数）"""
+    days, periods = rules['days'], rules['periods']
+    if not 0 < days <= len(WEEKDAYS) or not 0 < periods <= len(PERIODS):
+        raise ValueError(f"时间网格 {days} 天 × {periods} 节超出 {len(WEEKDAYS)} 天 × {len(PERIODS)} 节")
+    return days, periods
+
+
+def allowed_slots(rules, subject):
+    """课程可以排课的 (day, period) 列表：时间网格中去掉 slot_window 规则排除的时段"""
+    days, periods = time_grid(rules)
+    slots = [(day, period) for day in range(days) for period in range(periods)]
+    for rule in enabled_rules(rules, 'hard'):
+        if rule['type'] == 'slot_window' and subject in rule['subjects']:
+            slots = [(day, period) for day, period in slots if day in rule['days'] and period in rule['periods']]
+    return slots
+
+
+def add_at_most_one(model, index, literals):
+    """literals 中至多一个为真：省内存模式（index.compact）用更紧凑的 AtMostOne 约束，默认用线性约束"""
+    if index.compact:
+        model.AddAtMostOne(literals)
+    else:
+        model.Add(cp_model.LinearExpr.Sum(literals) <= 1)
+
+
+# === 硬约束：每个函数只在规则涉及的变量上添加约束 ===
+# 参数为模型、变量索引、规则字典和建模上下文（build_model() 的输入、busy_teacher_slots 和 rules）
+
+def mandatory_periods(model, index, rule, context):
+    """每天 periods 中的课时必须排课"""
+    periods = [period for period in rule['periods'] if period < index.periods]
+    for class_days in index.class_slot:
+        for class_periods in class_days:
+            for period in periods:
+                if index.compact:
+                    model.AddExactlyOne(class_periods[period])
+                else:
+                    model.Add(cp_model.LinearExpr.Sum(class_periods[period]) == 1)
+
+
+def daily_hours(model, index, rule, context):
+    """每周课时数大于 threshold 的课程每天 1-2 节，否则每天最多 1 节"""
+    subjects_required = context['subjects_required']
+    for c, class_ in enumerate(index.class_list):
+        for s, subject in enumerate(index.subject_list):
+            subject_count = subjects_required[class_].get(subject, 0)
+            for day_lessons in index.class_subject_day[c][s]:
+                lesson_count = cp_model.LinearExpr.Sum(day_lessons)
+                if subject_count > rule['threshold']:
+                    if index.compact:
+                        model.AddLinearConstraint(lesson_count, 1, 2)
+                    else:
+                        model.Add(lesson_count >= 1)
+                        model.Add(lesson_count <= 2)
+                elif len(day_lessons) > 1:
+                    add_at_most_one(model, index, day_lessons)
+
+
+def double_lesson(model, index, rule, context):
+    """当天同一门课的多节课必须连续，并且不能跨 split 这两节
+
+    省内存模式下如果有 daily_hours 规则，每天最多 2 节：跳过每天最多 1 节的课程，其余课程不建连续性变量，
+    直接要求排了第 p 节时之后不相邻的课时都不排（p 为 split 的第一节时 split 的第二节也不排），两种写法等价。
+    """
+    first, second = rule['split']
+    daily = find_rule(context['rules'], 'daily_hours')
+    if index.compact and daily is not None:
+        subjects_required = context['subjects_required']
+        for (t, c, s, day), lessons in index.lesson_day.items():
+            if subjects_required[index.class_list[c]].get(index.subject_list[s], 0) <= daily['threshold']:
+                continue
+            for period, lesson in enumerate(lessons):
+                if lesson is None:
+                    continue
+                apart = [lessons[later].Not() for later in range(period + 1, index.periods)
+                         if lessons[later] is not None and (later > period + 1 or (period, later) == (first, second))]
+                if apart:
+                    model.AddBoolAnd(apart).OnlyEnforceIf(lesson)
+        return
+
+    for (t, c, s, day), lessons in index.lesson_day.items():
+        # 计算这门课在这一天的总课程数
+        total_lessons = cp_model.LinearExpr.Sum([lesson for lesson in lessons if lesson is not None])
+        # 辅助变量：是否和下一节课连续，只在相邻两节课都可能排课时创建
+        consecutive_list = []
+        for period in range(index.periods - 1):
+            if lessons[period] is None or lessons[period + 1] is None:
+                continue
+            consecutive = model.NewBoolVar(index.var_name(
+                f"consecutive[{index.teacher_list[t]}, {index.class_list[c]}, {day}, {period}, {index.subject_list[s]}]"
+            ))
+            consecutive_list.append(consecutive)
+            # 连续性为真时，两节课都为真
+            model.add_bool_and([lessons[period], lessons[period + 1]]).only_enforce_if(consecutive)
+            # 连续性为假时，至少有一节为假
+            model.AddBoolOr([lessons[period].Not(), lessons[period + 1].Not()]).OnlyEnforceIf(consecutive.Not())
+        # 2 节课，consecutive_sum 为 1；1 节或 0 节课，consecutive_sum 为 0
+        model.Add(cp_model.LinearExpr.Sum(consecutive_list) >= total_lessons - 1)
+        # 不能在 split 这两节安排连续的两节课
+        if second < index.periods and lessons[first] is not None and lessons[second] is not None:
+            model.Add(lessons[first] + lessons[second] <= 1)
+
+
+# === 软约束：每个函数返回一个代价表达式，由 build_model() 乘以权重后求和作为目标函数 ===
+# 辅助变量在两个方向上都与决策变量绑定，省内存模式下也是如此，中间解的目标值就是课表的真实代价
+
+def time_block(model, index, rule, context):
+    """教师当天上午和下午都有课时代价为 1"""
+    busy_teacher_slots = context['busy_teacher_slots']
+    morning_periods = range(min(context['rules']['morning_periods'], index.periods))
+    afternoon_periods = range(len(morning_periods), index.periods)
+    time_block_penalties = []
+    for t, teacher in enumerate(index.teacher_list):
+        for day in range(index.days):
+            # 上午、下午可能排的课
+            morning_classes = [v for period in morning_periods for v in index.teacher_slot[t][day][period]]
+            afternoon_classes = [v for period in afternoon_periods for v in index.teacher_slot[t][day][period]]
+            # 其他班级已排定的课程
+            morning_busy = any((teacher, day, period) in busy_teacher_slots for period in morning_periods)
+            afternoon_busy = any((teacher, day, period) in busy_teacher_slots for period in afternoon_periods)
+
+            # 上午或下午不可能有课时，惩罚恒为 0，不需要辅助变量
+            if not (morning_classes or morning_busy) or not (afternoon_classes or afternoon_busy):
+                continue
+
+            # 辅助变量：教师在上午或下午是否有课
+            teacher_morning = model.NewBoolVar(index.var_name(f'morning_{teacher}_{day}'))
+            if morning_busy:
+                model.Add(teacher_morning == 1)
+            else:
+                model.AddBoolOr(morning_classes).OnlyEnforceIf(teacher_morning)
+                model.AddBoolAnd([v.Not() for v in morning_classes]).OnlyEnforceIf(teacher_morning.Not())
+
+            teacher_afternoon = model.NewBoolVar(index.var_name(f'afternoon_{teacher}_{day}'))
+            if afternoon_busy:
+                model.Add(teacher_afternoon == 1)
+            else:
+                model.AddBoolOr(afternoon_classes).OnlyEnforceIf(teacher_afternoon)
+                model.AddBoolAnd([v.Not() for v in afternoon_classes]).OnlyEnforceIf(teacher_afternoon.Not())
+
+            # 时间块惩罚变量：上午和下午都有课时为 1
+            time_block_penalty = model.NewBoolVar(index.var_name(f'time_block_penalty_{teacher}_{day}'))
+            model.AddBoolAnd([teacher_morning, teacher_afternoon]).OnlyEnforceIf(time_block_penalty)
+            model.AddBoolOr([teacher_morning.Not(), teacher_afternoon.Not(), time_block_penalty])
+            time_block_penalties.append(time_block_penalty)
+    return cp_model.LinearExpr.Sum(time_block_penalties)
+
+
+def early_periods(model, index, rule, context):
+    """subjects 中的课程在指定的天排在第 period 节的代价为 period，直接作为决策变量的系数"""
+    days = {index.subject_code[subject]: set(subject_days)
+            for subject, subject_days in rule['subjects'].items() if subject in index.subject_code}
+    subject_time_vars = []
+    subject_time_costs = []
+    for (t, c, day, period, s), course in zip(index.keys, index.vars):
+        if period > 0 and day in days.get(s, ()):
+            subject_time_vars.append(course)
+            subject_time_costs.append(period)
+    return cp_model.LinearExpr.WeightedSum(subject_time_vars, subject_time_costs)
+
+
+def day_double_lesson(model, index, rule, context):
+    """每门课程在第 day 天排了两节或以上时代价为 1
+
+    有 daily_hours 规则时，课时数不大于其 threshold 的课程每天最多 1 节，惩罚恒为 0，不建变量。
+    """
+    subjects_required = context['subjects_required']
+    daily = find_rule(context['rules'], 'daily_hours')
+    penalties = []
+    if rule['day'] >= index.days:
+        return cp_model.LinearExpr.Sum(penalties)
+    for c, class_ in enumerate(index.class_list):
+        for s, subject in enumerate(index.subject_list):
+            day_classes = index.class_subject_day[c][s][rule['day']]
+
+            # 每天最多 1 节的课程，或当天最多只有一节可能的课程，惩罚恒为 0
+            if daily is not None and subjects_required[class_].get(subject, 0) <= daily['threshold']:
+                continue
+            if len(day_classes) < 2:
+                continue
+
+            # penalty 为 1 当且仅当当天排了 2 节或以上；most 为当天最多可能的节数
+            most = 2 if daily is not None else len(day_classes)
+            penalty = model.NewBoolVar(index.var_name(f"penalty[{class_}, {subject}]"))
+            day_count = cp_model.LinearExpr.Sum(day_classes)
+            model.Add(day_count <= 1 + (most - 1) * penalty)
+            model.Add(day_count >= 2).OnlyEnforceIf(penalty)
+            penalties.append(penalty)
+    return cp_model.LinearExpr.Sum(penalties)
+
+
+# === 冗余约束和对称性破除：冗余约束不改变可行解，对称性破除只去掉与保留的解等价的解；默认不启用，见 SYMMETRY_RULES ===
+
+def teacher_load(model, index, rule, context):
+    """教师每周的总课时数：教师所教的班级课程都只有他一名教师能教时，总课时数就是这些课程的课时数之和"""
+    subjects_required = context['subjects_required']
+    group_teachers = defaultdict(set)
+    for t, c, s, day in index.lesson_day:
+        group_teachers[c, s].add(t)
+    load = [0] * len(index.teacher_list)
+    exact = [True] * len(index.teacher_list)
+    for (c, s), teachers in group_teachers.items():
+        if len(teachers) == 1:
+            load[next(iter(teachers))] += subjects_required[index.class_list[c]].get(index.subject_list[s], 0)
+        else:
+            for t in teachers:
+                exact[t] = False
+    for t, teacher_days in enumerate(index.teacher_slot):
+        teacher_vars = [v for teacher_periods in teacher_days for teacher_classes in teacher_periods
+                        for v in teacher_classes]
+        if teacher_vars and exact[t]:
+            model.Add(cp_model.LinearExpr.Sum(teacher_vars) == load[t])
+
+
+def class_daily_count(model, index, rule, context):
+    """班级每天的课时数：不少于必排课时数和每天都要上的课程数，不多于各课程每天最多节数之和"""
+    rules = context['rules']
+    mandatory = find_rule(rules, 'mandatory_periods')
+    daily = find_rule(rules, 'daily_hours')
+    mandatory_count = len([period for period in mandatory['periods'] if period < index.periods]) if mandatory else 0
+    for c, class_ in enumerate(index.class_list):
+        hours = [count for count in context['subjects_required'][class_].values() if count > 0]
+        lower, upper = mandatory_count, index.periods
+        if daily is not None:
+            lower = max(lower, len([count for count in hours if count > daily['threshold']]))
+            upper = min(upper, sum(2 if count > daily['threshold'] else 1 for count in hours))
+        # 其余各天都取上限（下限）时，这一天至少（至多）要排的课时数
+        total = sum(hours)
+        lower, upper = max(lower, total - (index.days - 1) * upper), min(upper, total - (index.days - 1) * lower)
+        for class_periods in index.class_slot[c]:
+            day_vars = [v for class_courses in class_periods for v in class_courses]
+            model.AddLinearConstraint(cp_model.LinearExpr.Sum(day_vars), lower, upper)
+
+
+def _slot_codes(index, slots):
+    # (class, day, period) -> 该时段的课程编码：排了第 s 门课程时为 s + 1，没有排课时为 0
+    codes = {}
+    for (t, c, day, period, s), var in zip(index.keys, index.vars):
+        if (c, day, period) in slots:
+            codes.setdefault((c, day, period), ([], []))
+            codes[c, day, period][0].append(var)
+            codes[c, day, period][1].append(s + 1)
+    return {slot: cp_model.LinearExpr.WeightedSum(*codes[slot]) if slot in codes else 0 for slot in slots}
+
+
+def _lex_chain(model, index, groups, slot_of):
+    # 各组按顺序要求 key 不减，key 为前几个位置的课程编码按字典序组成的整数
+    # 所有对称性都按（天，课时，班级）的同一个全局顺序比较，保证多条对称性破除约束同时成立时不会去掉全部最优解
+    base = len(index.subject_list) + 1
+    slots = {slot_of(member, position) for members, positions in groups for member in members
+             for position in range(positions)}
+    codes = _slot_codes(index, slots)
+    for members, positions in groups:
+        keys = [cp_model.LinearExpr.WeightedSum([codes[slot_of(member, position)] for position in range(positions)],
+                                                [base ** (positions - 1 - position) for position in range(positions)])
+                for member in members]
+        for first, second in zip(keys, keys[1:]):
+            model.Add(first <= second)
+
+
+def _special_days(context):
+    # 有预排、不排课或已排定课程的天不能与其他天互换
+    days = {course.get('week') for course in context['confirm_courses']}
+    days |= {course.get('week') for course in context['no_courses']}
+    days |= {day for teacher, day, period in context['busy_teacher_slots']}
+    return days
+
+
+def class_symmetry(model, index, rule, context):
+    """课时设置和任课教师完全相同、又没有预排和不排课的班级，课表可以整体互换；
+    按班级顺序要求它们第一天前 slots 节的课程编码按字典序不减，只保留其中一种排列"""
+    special = {course.get('class') for course in context['confirm_courses']}
+    special |= {course.get('class') for course in context['no_courses']}
+    groups = defaultdict(list)
+    for c, class_ in enumerate(index.class_list):
+        if class_ not in special:
+            signature = json.dumps([context['subjects_required'][class_], context['teacher_required'].get(class_, {})],
+                                   sort_keys=True, ensure_ascii=False)
+            groups[signature].append(c)
+    positions = min(rule['slots'], index.periods)
+    _lex_chain(model, index, [(members, positions) for members in groups.values() if len(members) > 1],
+               lambda c, period: (c, 0, period))
+
+
+def _day_signature(rules, day):
+    # 各规则对这一天的设置，设置相同的两天在规则上可以互换
+    signature = []
+    for kind in ('hard', 'soft'):
+        for rule in enabled_rules(rules, kind):
+            if rule['type'] == 'slot_window':
+                signature.append(day in rule['days'])
+            elif rule['type'] == 'early_periods':
+                signature.append(sorted(subject for subject, days in rule['subjects'].items() if day in days))
+            elif rule['type'] == 'day_double_lesson':
+                signature.append(rule['day'] == day)
+    return json.dumps(signature, ensure_ascii=False)
+
+
+def day_symmetry(model, index, rule, context):
+    """规则设置相同、又没有预排、不排课和已排定课程的天，整个学校的课表可以互换；
+    按天的顺序要求前 classes 个班级第一节的课程编码按字典序不减，只保留其中一种排列"""
+    special = _special_days(context)
+    groups = defaultdict(list)
+    for day in range(index.days):
+        if day not in special:
+            groups[_day_signature(context['rules'], day)].append(day)
+    positions = min(rule['classes'], len(index.class_list))
+    _lex_chain(model, index, [(members, positions) for members in groups.values() if len(members) > 1],
+               lambda day, c: (c, day, 0))
+
+
+# 规则类型 -> 建模函数；slot_window 在创建决策变量时生效（见 allowed_slots()），不需要建模函数
+HARD_RULES = {
+    'slot_window': None,
+    'mandatory_periods': mandatory_periods,
+    'daily_hours': daily_hours,
+    'double_lesson': double_lesson,
+    'teacher_load': teacher_load,
+    'class_daily_count': class_daily_count,
+    'class_symmetry': class_symmetry,
+    'day_symmetry': day_symmetry,
+}
+SOFT_RULES = {
+    'time_block': time_block,
+    'early_periods': early_periods,
+    'day_double_lesson': day_double_lesson,
+}
+
+
+def check_rules(rules):
+    """检查规则集的时间网格和规则类型，有错误时抛出 ValueError"""
+    time_grid(rules)
+    for kind, registry in (('hard', HARD_RULES), ('soft', SOFT_RULES)):
+        for rule in rules[kind]:
+            if rule['type'] not in registry:
+                raise ValueError(f"未知的{'硬' if kind == 'hard' else '软'}约束类型：{rule['type']}，可选 {list(registry)}")
+
+
+def soft_weights(rules, weights=None):
+    """启用的软约束的权重 {规则名: 权重}：规则集中的 weight 按规则名被 weights 覆盖
+
+    weights 中不是启用的软约束名的键（例如拼错的规则名）抛出 ValueError，避免静默地按默认目标函数求解。
+    """
+    resolved = {rule['name']: rule['weight'] for rule in enabled_rules(rules, 'soft')}
+    unknown = [name for name in (weights or {}) if name not in resolved]
+    if unknown:
+        raise ValueError(f"未知的软约束权重：{unknown}，可选 {list(resolved)}")
+    return {**resolved, **(weights or {})}
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ortools.sat.python import cp_model
+
+from export import export_timetable
+from rules import DEFAULT_RULES, soft_weights
+from TimeTable import add_hints, build_model, solve_model
+
+# 场景中可以覆盖的输入
+INPUT_KEYS = ['teacher_subjects', 'subjects_required', 'teacher_required', 'confirm_courses', 'no_courses']
+
+
+def run_scenario(problem, scenario, workers, output_dir):
+    """在当前进程中求解一个场景，返回结果字典
+
+    scenario 是一个字典：name 为场景名（决定输出目录），INPUT_KEYS 中的键覆盖基础输入 problem，
+    weights 覆盖目标函数权重，rules 为规则集（见 rules.py），另外可以给出 hints、time_limit、relative_gap、stop_at_first_solution。
+    """
+    name = scenario['name']
+    inputs = {key: scenario.get(key, problem.get(key, [] if key.endswith('courses') else {})) for key in INPUT_KEYS}
+    start = time.perf_counter()
+
+    model, index = build_model(**inputs, weights=scenario.get('weights'), rules=scenario.get('rules'))
+    if scenario.get('hints'):
+        add_hints(model, index, scenario['hints'])
+
+    solver = cp_model.CpSolver()
+    # 每个场景只用分配给它的核心
+    solver.parameters.num_search_workers = workers
+    status, courses = solve_model(model, index, scenario.get('time_limit', 3600),
+                                  scenario.get('stop_at_first_solution', False), scenario.get('relative_gap'),
+                                  solver=solver)
+
+    result = {
+        'name': name,
+        'status': solver.StatusName(status),
+        'objective': solver.ObjectiveValue() if courses is not None else None,
+        'best_bound': solver.BestObjectiveBound() if courses is not None else None,
+        'wall_seconds': round(time.perf_counter() - start, 3),
+        'workers': workers,
+        'class_path': None,
+        'teacher_path': None,
+        'courses': courses,
+    }
+    if courses is not None:
+        paths = export_timetable(courses, list(inputs['subjects_required'].keys()),
+                                 list(inputs['teacher_subjects'].keys()), os.path.join(output_dir, name))
+        result['class_path'], result['teacher_path'] = paths['excel']
+    return result
+
+
+def run_scenarios(problem, scenarios, output_dir='scenarios', parallel=None, cores=None):
+    """在进程池中并行求解多个场景，按场景顺序返回结果字典列表
+
+    同时运行 parallel 个场景（默认取场景数和核心数中较小的一个），
+    cores 个核心（默认全部）平均分给同时运行的场景，作为各自的 num_search_workers。
+    """
+    names = [scenario['name'] for scenario in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError("场景名不能重复，场景名决定输出目录")
+    # 在启动进程池之前检查权重，拼错的规则名不会按默认目标函数求解
+    for scenario in scenarios:
+        try:
+            soft_weights(scenario.get('rules') or DEFAULT_RULES, scenario.get('weights'))
+        except ValueError as error:
+            raise ValueError(f"场景 {scenario['name']}：{error}") from None
+    cores = cores or os.cpu_count()
+    parallel = parallel or min(len(scenarios), cores)
+    workers = max(1, cores // parallel)
+
+    with ProcessPoolExecutor(max_workers=parallel) as pool:
+        futures = [pool.submit(run_scenario, problem, scenario, workers, output_dir) for scenario in scenarios]
+        return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+    from loader import load_problem
+
+    parser = argparse.ArgumentParser(description='并行求解多个排课场景')
+    parser.add_argument('scenarios', help='场景列表 JSON 文件，每个场景是一个字典，见 run_scenario()')
+    parser.add_argument('--workbook', default='./resources/data.xlsx')
+    parser.add_argument('--output-dir', default='scenarios')
+    parser.add_argument('--parallel', type=int, help='同时运行的场景数')
+    parser.add_argument('--cores', type=int, help='分给全部场景的核心数')
+    args = parser.parse_args()
+
+    with open(args.scenarios, encoding='utf-8') as f:
+        scenario_list = json.load(f)
+    results = run_scenarios(load_problem(args.workbook), scenario_list, args.output_dir, args.parallel, args.cores)
+    for result in results:
+        print(f"{result['name']}\t{result['status']}\t{result['objective']}\t{result['wall_seconds']}s\t{result['class_path']}")
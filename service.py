@@ -0,0 +1,460 @@
+import argparse
+import itertools
+import json
+import numbers
+import os
+import queue
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# 服务启动时一次导入 pandas 和 OR-Tools，之后的任务不再付出导入和启动进程的开销
+from ortools.sat.python import cp_model
+
+from cache import ResultCache
+from export import check_formats, table_courses
+from loader import validate_problem
+from rules import DEFAULT_RULES, check_rules, soft_weights
+from telemetry import GapBelow, NoImprovement, Telemetry
+from TimeTable import plan, stop_policy_key
+from twostage import feasible_timetable
+
+# 任务请求中 problem 的键，与 plan() 的参数相同；其他键（例如 load_problem() 返回的 grade_teacher）忽略
+PROBLEM_KEYS = ['teacher_subjects', 'subjects_required', 'teacher_required', 'confirm_courses', 'no_courses']
+
+# 任务请求中 options 的默认值
+DEFAULT_OPTIONS = {
+    'time_limit': 600,
+    'relative_gap': None,
+    'stop_at_first_solution': False,
+    'weights': None,
+    'rules': None,
+    'compact': False,
+    'symmetry_breaking': False,
+    # 先用 twostage.feasible_timetable() 求一个可行课表，立即推送，再作为提示求解完整模型
+    'quick_start': True,
+    'quick_start_time_limit': 60,
+    # 提前停止：最近 no_improvement 秒没有改进，或相对差距低于 gap_below%
+    'no_improvement': None,
+    'gap_below': None,
+    # 推送中间课表的最小间隔（秒），目标值进度每个改进解都推送
+    'timetable_interval': 1.0,
+    'formats': ['csv'],
+    # 每个任务的求解线程数，None 时把服务的核心平均分给同时求解的任务
+    'num_search_workers': None,
+}
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _is_count(value):
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool) and value >= 0
+
+
+def check_options(options):
+    """检查任务选项的类型和取值，有错误时抛出 ValueError；提交时调用，避免任务排队后才在工作线程中出错"""
+    for name in ('time_limit', 'quick_start_time_limit'):
+        if not _is_number(options[name]) or options[name] <= 0:
+            raise ValueError(f"{name} 必须是正数")
+    if not _is_number(options['timetable_interval']) or options['timetable_interval'] < 0:
+        raise ValueError("timetable_interval 必须是非负数")
+    for name in ('relative_gap', 'no_improvement', 'gap_below'):
+        if options[name] is not None and (not _is_number(options[name]) or options[name] < 0):
+            raise ValueError(f"{name} 必须是非负数或 null")
+    for name in ('stop_at_first_solution', 'compact', 'symmetry_breaking', 'quick_start'):
+        if not isinstance(options[name], bool):
+            raise ValueError(f"{name} 必须是 true 或 false")
+    workers = options['num_search_workers']
+    if workers is not None and (not _is_count(workers) or workers == 0):
+        raise ValueError("num_search_workers 必须是正整数或 null")
+    if not isinstance(options['formats'], list) or not all(isinstance(format_, str) for format_ in options['formats']):
+        raise ValueError("formats 必须是字符串列表，例如 [\"csv\"]")
+    check_formats(options['formats'])
+    rules, weights = options['rules'], options['weights']
+    if rules is not None and not isinstance(rules, dict):
+        raise ValueError("rules 必须是规则集对象或 null，格式见 rules.DEFAULT_RULES")
+    if weights is not None and (not isinstance(weights, dict) or not all(map(_is_number, weights.values()))):
+        raise ValueError("weights 必须是 {规则名: 数值} 或 null")
+    try:
+        check_rules(rules or DEFAULT_RULES)
+        soft_weights(rules or DEFAULT_RULES, weights)
+    except (KeyError, TypeError) as error:
+        raise ValueError(f"rules 格式错误：缺少或无效的 {error}，格式见 rules.DEFAULT_RULES")
+
+
+def check_problem(problem):
+    """检查任务输入的结构和引用，有错误时抛出 ValueError，列出全部错误
+
+    结构正确后再用 loader.validate_problem() 检查预排和不排课引用的班级、教师和课程。
+    """
+    errors = []
+    teacher_subjects = problem['teacher_subjects']
+    if not isinstance(teacher_subjects, dict) or not all(
+            isinstance(subjects, list) and all(isinstance(subject, str) for subject in subjects)
+            for subjects in teacher_subjects.values()):
+        errors.append("teacher_subjects 必须是 {教师: [课程, ...]}")
+    subjects_required = problem['subjects_required']
+    valid_required = isinstance(subjects_required, dict) and all(
+        isinstance(required, dict) and all(map(_is_count, required.values()))
+        for required in subjects_required.values())
+    if not valid_required:
+        errors.append("subjects_required 必须是 {班级: {课程: 课时数}}，课时数为非负整数")
+    teacher_required = problem['teacher_required']
+    if not isinstance(teacher_required, dict) or not all(
+            isinstance(teachers, dict) and all(isinstance(teacher, str) for teacher in teachers.values())
+            for teachers in teacher_required.values()):
+        errors.append("teacher_required 必须是 {班级: {课程: 教师}}")
+    elif valid_required:
+        errors.extend(f"teacher_required：班级 {class_} 不在 subjects_required 中"
+                      for class_ in teacher_required if class_ not in subjects_required)
+    for name in ('confirm_courses', 'no_courses'):
+        courses = problem[name]
+        if not isinstance(courses, list) or not all(
+                isinstance(course, dict) and all(isinstance(course.get(key), str)
+                                                 for key in ('class', 'teacher_name', 'subject'))
+                and _is_count(course.get('week')) and _is_count(course.get('sort')) for course in courses):
+            errors.append(f"{name} 必须是课程列表，每门课程为 {{class, teacher_name, subject, week, sort}}，"
+                          "week、sort 为非负整数")
+    if not errors:
+        errors = validate_problem(problem)
+    if errors:
+        raise ValueError(f"problem 有 {len(errors)} 处错误：\n" + "\n".join(errors))
+
+
+class Cancelled:
+    """提前停止策略：任务被取消，或者 policy（可以为 None）要求停止
+
+    结果缓存的指纹只取决于 policy；任务被取消时 interrupted 为 True，plan() 不缓存这时的结果。
+    """
+
+    def __init__(self, event, policy=None):
+        self.event = event
+        self.policy = policy
+
+    @property
+    def interrupted(self):
+        return self.event.is_set()
+
+    def cache_key(self):
+        return stop_policy_key(self.policy)
+
+    def __call__(self, state):
+        return self.event.is_set() or (self.policy is not None and self.policy(state))
+
+
+class Job:
+    """一个排课任务：状态、按顺序编号的事件记录和结果
+
+    status 为 queued、running、done、failed 或 cancelled，结束后不再改变；事件是 Telemetry 记录，另加 seq 序号，
+    除了建模、求解事件外还有 job（状态变化）和 timetable（中间或最终课表）。
+    任务结束时中间课表（stage 不是 final 的 timetable 事件）去掉 courses，只保留事件本身，事件序号不变。
+    """
+
+    def __init__(self, job_id, problem, options):
+        self.id = job_id
+        self.problem = problem
+        self.options = options
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self.cancel_event = threading.Event()
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def emit(self, record):
+        with self.condition:
+            self.events.append({'seq': len(self.events), **record})
+            self.condition.notify_all()
+
+    def set_status(self, status, **fields):
+        """改变状态并记录 job 事件，返回是否改变；任务已经结束时不改变"""
+        with self.condition:
+            if self.finished:
+                return False
+            self.status = status
+            if self.finished:
+                self.finished_at = time.time()
+                self.events = [{key: value for key, value in event.items() if key != 'courses'}
+                               if event['event'] == 'timetable' and event.get('stage') != 'final' else event
+                               for event in self.events]
+            self.emit({'time': time.time(), 'event': 'job', 'status': status, **fields})
+            return True
+
+    def events_since(self, seq, timeout):
+        """序号不小于 seq 的事件；没有新事件且任务未结束时最多等待 timeout 秒"""
+        with self.condition:
+            if len(self.events) <= seq and not self.finished:
+                self.condition.wait(timeout)
+            return self.events[seq:]
+
+    def summary(self):
+        objectives = [event['objective'] for event in self.events
+                      if event['event'] == 'solution' and event.get('objective') is not None]
+        return {'id': self.id, 'status': self.status, 'created': self.created, 'events': len(self.events),
+                'objective': objectives[-1] if objectives else None, 'error': self.error}
+
+
+class SolveService:
+    """排课任务队列：max_concurrent 个工作线程依次取出任务调用 plan()
+
+    CP-SAT 求解时释放 GIL，多个任务可以在同一进程中同时求解，cores 个核心（默认全部）平均分给同时求解的任务，
+    作为各自的 num_search_workers，不输出求解日志；取消任务通过 Cancelled 停止策略，
+    由 SolveMonitor 调用 StopSearch() 结束搜索，返回取消前找到的最好课表。
+    结果按任务的 formats 导出到 output_dir/任务编号；cache 为 ResultCache 时相同的输入直接返回缓存的课表。
+    已结束的任务最多保留 keep_finished 个，结束超过 finished_ttl 秒（None 表示不限）的任务在下次提交时删除。
+    """
+
+    def __init__(self, max_concurrent=1, output_dir='service_output', cache=None, cores=None, keep_finished=100,
+                 finished_ttl=3600):
+        self.output_dir = output_dir
+        self.cache = cache
+        self.keep_finished = keep_finished
+        self.finished_ttl = finished_ttl
+        self.search_workers = max(1, (cores or os.cpu_count()) // max_concurrent)
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max_concurrent)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, payload):
+        """提交任务，payload 为 {'problem': {...}, 'options': {...}}，返回 Job；输入或选项的格式错误时抛出 ValueError"""
+        if not isinstance(payload, dict):
+            raise ValueError("请求体必须是 JSON 对象")
+        problem = payload.get('problem')
+        if not isinstance(problem, dict) or not {'teacher_subjects', 'subjects_required'} <= problem.keys():
+            raise ValueError("problem 至少需要 teacher_subjects 和 subjects_required")
+        if not isinstance(payload.get('options') or {}, dict):
+            raise ValueError("options 必须是 JSON 对象")
+        unknown = set(payload.get('options') or {}) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"未知的选项：{sorted(unknown)}")
+        options = {**DEFAULT_OPTIONS, **(payload.get('options') or {})}
+        check_options(options)
+        problem = {key: problem.get(key, [] if key.endswith('courses') else {}) for key in PROBLEM_KEYS}
+        check_problem(problem)
+        with self._lock:
+            self._prune()
+            job = Job(str(next(self._ids)), problem, options)
+            self.jobs[job.id] = job
+        job.set_status('queued', position=self.queue.qsize())
+        self.queue.put(job)
+        return job
+
+    def _prune(self):
+        # 删除超出数量或超过保留时间的已结束任务，最早结束的先删除
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.finished_at)
+        expired = finished[:max(len(finished) - self.keep_finished, 0)]
+        if self.finished_ttl is not None:
+            now = time.time()
+            expired += [job for job in finished if now - job.finished_at > self.finished_ttl]
+        for job in expired:
+            self.jobs.pop(job.id, None)
+
+    def cancel(self, job_id):
+        """取消任务：排队中的任务不再执行，正在求解的任务停止搜索，返回 Job；任务不存在时返回 None"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            # 与工作线程的 set_status('running') 互斥：要么任务还在排队并直接结束，要么由求解中的停止策略结束
+            with job.condition:
+                job.cancel_event.set()
+                if job.status == 'queued':
+                    job.set_status('cancelled')
+        return job
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if not job.cancel_event.is_set():
+                self._run(job)
+            self.queue.task_done()
+
+    def _run(self, job):
+        options = job.options
+        telemetry = Telemetry(job.emit)
+        workers = options['num_search_workers'] or self.search_workers
+        if not job.set_status('running'):
+            # 在取出任务之后、开始求解之前被取消
+            return
+        try:
+            hints = None
+            if options['quick_start']:
+                status, hints = feasible_timetable(**job.problem, time_limit=min(options['quick_start_time_limit'],
+                                                                                 options['time_limit']),
+                                                   workers=workers, rules=options['rules'],
+                                                   stop_policy=Cancelled(job.cancel_event))
+                if hints is not None:
+                    telemetry.emit('timetable', stage='feasible', courses=hints)
+            if job.cancel_event.is_set():
+                job.result = hints
+                job.set_status('cancelled')
+                return
+
+            policy = None
+            if options['no_improvement'] is not None:
+                policy = NoImprovement(options['no_improvement'])
+            elif options['gap_below'] is not None:
+                policy = GapBelow(options['gap_below'])
+            last_sent = [0.0]
+            solver = cp_model.CpSolver()
+            solver.parameters.num_search_workers = workers
+
+            def send_timetable(table):
+                # 在求解线程中执行，按 timetable_interval 限制推送频率
+                now = time.perf_counter()
+                if now - last_sent[0] >= options['timetable_interval']:
+                    last_sent[0] = now
+                    telemetry.emit('timetable', stage='solve', courses=table_courses(table))
+
+            courses = plan(**job.problem, hints=hints, time_limit=options['time_limit'],
+                           relative_gap=options['relative_gap'], stop_at_first_solution=options['stop_at_first_solution'],
+                           weights=options['weights'], rules=options['rules'], compact=options['compact'],
+                           symmetry_breaking=options['symmetry_breaking'], telemetry=telemetry,
+                           stop_policy=Cancelled(job.cancel_event, policy), on_solution=send_timetable,
+                           output_dir=os.path.join(self.output_dir, job.id), formats=options['formats'],
+                           cache=self.cache, solver=solver)
+            job.result = courses if courses is not None else hints
+            if job.result is not None:
+                telemetry.emit('timetable', stage='final', courses=job.result)
+            if job.result is None:
+                job.error = "在时间上限内没有找到可行课表"
+            job.set_status('cancelled' if job.cancel_event.is_set() else 'done' if job.result is not None else 'failed')
+        except Exception as error:
+            job.error = str(error)
+            job.set_status('failed', error=job.error, traceback=traceback.format_exc())
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP/JSON 接口
+
+    POST /jobs                      提交任务，请求体为 {"problem": {...}, "options": {...}}，返回任务摘要
+    GET  /jobs                      全部任务摘要
+    GET  /jobs/<id>                 任务摘要和结果课表
+    GET  /jobs/<id>/events?since=n  从第 n 个事件开始逐行推送 JSON 事件，任务结束后关闭连接
+    DELETE /jobs/<id>               取消任务（也可以 POST /jobs/<id>/cancel）
+    """
+
+    # 等待新事件的间隔，期间没有事件时推送一个空行保持连接
+    poll_interval = 15
+
+    def _send_json(self, data, code=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job(self, job_id):
+        job = self.server.service.jobs.get(job_id)
+        if job is None:
+            self._send_json({'error': f"任务不存在：{job_id}"}, 404)
+        return job
+
+    def _route(self):
+        url = urlparse(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['jobs']:
+            self._send_json([job.summary() for job in self.server.service.jobs.values()])
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self._job(parts[1])
+            if job is not None:
+                self._send_json({**job.summary(), 'result': job.result})
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            job = self._job(parts[1])
+            if job is not None:
+                try:
+                    since = int(query.get('since', ['0'])[0])
+                except ValueError:
+                    self._send_json({'error': "since 必须是整数"}, 400)
+                    return
+                self._stream(job, max(since, 0))
+        else:
+            self._send_json({'error': f"未知的路径：{self.path}"}, 404)
+
+    def _stream(self, job, seq):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.end_headers()
+        try:
+            while True:
+                events = job.events_since(seq, self.poll_interval)
+                for event in events:
+                    self.wfile.write(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n')
+                if not events:
+                    self.wfile.write(b'\n')
+                self.wfile.flush()
+                seq += len(events)
+                if job.finished and seq >= len(job.events):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts == ['jobs']:
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                job = self.server.service.submit(payload)
+            except ValueError as error:
+                self._send_json({'error': str(error)}, 400)
+                return
+            self._send_json(job.summary(), 202)
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            self.do_DELETE()
+        else:
+            self._send_json({'error': f"未知的路径：{self.path}"}, 404)
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            job = self._job(parts[1])
+            if job is not None:
+                self.server.service.cancel(job.id)
+                self._send_json(job.summary())
+        else:
+            self._send_json({'error': f"未知的路径：{self.path}"}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=8080, max_concurrent=1, output_dir='service_output', cache_dir=None, cores=None,
+          keep_finished=100, finished_ttl=3600):
+    """启动排课服务，阻塞直到进程结束；cores、keep_finished、finished_ttl 见 SolveService"""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = SolveService(max_concurrent, output_dir, ResultCache(cache_dir) if cache_dir else None, cores,
+                                  keep_finished, finished_ttl)
+    print(f"排课服务已启动：http://{host}:{server.server_address[1]}，同时求解 {max_concurrent} 个任务")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='排课服务：HTTP/JSON 提交排课任务，推送求解进度，支持取消')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=1, help='同时求解的任务数')
+    parser.add_argument('--output-dir', default='service_output', help='结果导出目录，每个任务一个子目录')
+    parser.add_argument('--cache-dir', help='结果缓存目录，不指定时不使用缓存')
+    parser.add_argument('--cores', type=int, help='平均分给同时求解的任务的核心数，默认全部')
+    parser.add_argument('--keep-finished', type=int, default=100, help='最多保留的已结束任务数')
+    parser.add_argument('--finished-ttl', type=float, default=3600, help='已结束任务的保留时间（秒）')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.concurrency, args.output_dir, args.cache_dir, args.cores, args.keep_finished,
+          args.finished_ttl)
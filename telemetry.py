@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+
+from ortools.sat.python import cp_model
+
+
+class Telemetry:
+    """建模和求解过程的事件记录
+
+    每个事件是一个带时间戳的字典（time、elapsed、event 以及事件字段），依次交给各个 sink；
+    sink 是任意接受一个字典的可调用对象，例如 JsonLinesSink 或界面的进度回调。没有 sink 时所有记录都被忽略。
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        self.start = time.perf_counter()
+        self._mark = self.start
+        self._counts = (0, 0)
+
+    def emit(self, event, **fields):
+        if not self.sinks:
+            return
+        record = {'time': time.time(), 'elapsed': round(time.perf_counter() - self.start, 3), 'event': event}
+        record.update(fields)
+        for sink in self.sinks:
+            sink(record)
+
+    def begin_build(self, model):
+        """开始建模，之后每个 mark() 记录与上一个 mark 之间的耗时和新增的变量、约束数"""
+        self._mark = time.perf_counter()
+        proto = model.Proto()
+        self._counts = (len(proto.variables), len(proto.constraints))
+        self.emit('build_start')
+
+    def mark(self, phase, model):
+        now = time.perf_counter()
+        proto = model.Proto()
+        counts = (len(proto.variables), len(proto.constraints))
+        self.emit('build_phase', phase=phase, seconds=round(now - self._mark, 4),
+                  variables=counts[0] - self._counts[0], constraints=counts[1] - self._counts[1])
+        self._mark = now
+        self._counts = counts
+
+    def end_build(self, model):
+        proto = model.Proto()
+        self.emit('model', variables=len(proto.variables), constraints=len(proto.constraints))
+
+
+class JsonLinesSink:
+    """把事件逐行写成 JSON 的 sink"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class NoImprovement:
+    """提前停止策略：最近 seconds 秒内目标值没有改进"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def cache_key(self):
+        return ['NoImprovement', self.seconds]
+
+    def __call__(self, state):
+        return state['objective'] is not None and state['wall_time'] - state['improved_at'] >= self.seconds
+
+
+class GapBelow:
+    """提前停止策略：目标值与下界的相对差距低于 percent%"""
+
+    def __init__(self, percent):
+        self.percent = percent
+
+    def cache_key(self):
+        return ['GapBelow', self.percent]
+
+    def __call__(self, state):
+        objective = state['objective']
+        if objective is None:
+            return False
+        gap = abs(objective - state['bound']) / max(abs(objective), 1)
+        return gap * 100 < self.percent
+
+
+class SolveMonitor(cp_model.CpSolverSolutionCallback):
+    """求解回调：记录每个改进解和下界变化，并按提前停止策略结束搜索
+
+    stop_policy 接受一个状态字典（wall_time、objective、bound、improved_at、solutions），返回 True 时停止；
+    策略的 cache_key() 返回可以序列化为 JSON 的参数表示，有 cache_key() 的策略才能与 plan() 的结果缓存一起使用。
+    除了在每个解和下界更新时检查外，后台线程每 check_interval 秒检查一次，使“长时间无改进”也能及时生效。
+    on_solution 不为空时在每个改进解上以本回调为参数调用，可以从中读取当前解的变量值。
+    """
+
+    def __init__(self, telemetry, stop_policy=None, check_interval=0.5, on_solution=None):
+        super().__init__()
+        self.telemetry = telemetry
+        self.stop_policy = stop_policy
+        self.on_solution = on_solution
+        self.check_interval = check_interval
+        self.solver = None
+        self.start = None
+        self.lock = threading.Lock()
+        self.state = {'wall_time': 0.0, 'objective': None, 'bound': None, 'improved_at': 0.0, 'solutions': 0}
+        self._done = threading.Event()
+        self._stopped = False
+
+    def on_solution_callback(self):
+        with self.lock:
+            wall_time = time.perf_counter() - self.start
+            self.state['wall_time'] = wall_time
+            self.state['objective'] = self.ObjectiveValue()
+            self.state['bound'] = self.BestObjectiveBound()
+            self.state['improved_at'] = wall_time
+            self.state['solutions'] += 1
+            state = dict(self.state)
+        self.telemetry.emit('solution', wall_time=round(wall_time, 3), objective=state['objective'],
+                            bound=state['bound'], solutions=state['solutions'])
+        if self.on_solution is not None:
+            self.on_solution(self)
+        self._check(state)
+
+    def on_bound(self, bound):
+        with self.lock:
+            self.state['bound'] = bound
+            self.state['wall_time'] = time.perf_counter() - self.start
+            state = dict(self.state)
+        self.telemetry.emit('bound', wall_time=round(state['wall_time'], 3), bound=bound)
+        self._check(state)
+
+    def _check(self, state):
+        if self.stop_policy is None or self._stopped or not self.stop_policy(state):
+            return
+        with self.lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self.telemetry.emit('early_stop', wall_time=round(state['wall_time'], 3), objective=state['objective'],
+                            bound=state['bound'])
+        self.solver.StopSearch()
+
+    def _watch(self):
+        while not self._done.wait(self.check_interval):
+            with self.lock:
+                self.state['wall_time'] = time.perf_counter() - self.start
+                state = dict(self.state)
+            self._check(state)
+
+    def solve(self, solver, model):
+        """用 solver 求解 model，记录开始和结束事件，返回求解状态"""
+        self.solver = solver
+        self.start = time.perf_counter()
+        # 调用方可能复用 solver，求解结束后恢复原来的下界回调，本次的停止策略不会影响之后的求解
+        previous_callback = solver.best_bound_callback
+        solver.best_bound_callback = self.on_bound
+        self.telemetry.emit('solve_start', max_time_in_seconds=solver.parameters.max_time_in_seconds,
+                            num_search_workers=solver.parameters.num_search_workers)
+        watcher = None
+        if self.stop_policy is not None:
+            watcher = threading.Thread(target=self._watch, daemon=True)
+            watcher.start()
+        try:
+            status = solver.Solve(model, self)
+        finally:
+            self._done.set()
+            solver.best_bound_callback = previous_callback
+            if watcher is not None:
+                watcher.join()
+        self.telemetry.emit('solve_end', status=solver.StatusName(status), wall_time=round(solver.WallTime(), 3),
+                            objective=self.state['objective'], bound=solver.BestObjectiveBound(),
+                            solutions=self.state['solutions'], early_stop=self._stopped)
+        return status
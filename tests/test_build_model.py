@@ -0,0 +1,223 @@
+"""build_model() 的稀疏建模与原来的稠密建模在 resources/data.xlsx 上等价"""
+import os
+
+import pytest
+from ortools.sat.python import cp_model
+
+from loader import load_problem
+from TimeTable import build_model
+from twostage import evaluate, feasible_timetable
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'data.xlsx')
+
+
+def build_dense_model(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[]):
+    """原来 plan() 中的稠密建模，只用于对照：返回模型、决策变量和被约束固定为 0 的决策变量的键
+
+    每个 (教师, 班级, 天, 节, 课程) 都建变量，再用“只教固定班级、固定课程”、体育和不排课的约束固定为 0。
+    """
+    teacher_list = list(teacher_subjects.keys())
+    class_list = list(subjects_required.keys())
+    subject_list = list(dict.fromkeys(subject for required in subjects_required.values() for subject in required))
+    model = cp_model.CpModel()
+    pinned = set()
+
+    x = {}
+    for teacher in teacher_list:
+        for class_ in class_list:
+            for day in range(6):
+                for period in range(9):
+                    for subject in subject_list:
+                        x[teacher, class_, day, period, subject] = model.NewBoolVar('')
+    for course in confirm_courses:
+        model.Add(x[course['teacher_name'], course['class'], course['week'], course['sort'], course['subject']] == 1)
+    for course in no_courses:
+        key = (course['teacher_name'], course['class'], course['week'], course['sort'], course['subject'])
+        model.Add(x[key] == 0)
+        pinned.add(key)
+
+    consecutive = {}
+    for teacher in teacher_list:
+        for class_ in class_list:
+            for day in range(6):
+                for period in range(8):
+                    for subject in subject_list:
+                        consecutive[teacher, class_, day, period, subject] = model.NewBoolVar('')
+
+    # 每个老师只给固定的班级、只教授固定的课程
+    for class_ in class_list:
+        class_teachers = teacher_required.get(class_, {}).values()
+        for teacher in teacher_list:
+            for subject in subject_list:
+                keys = [(teacher, class_, day, period, subject) for day in range(6) for period in range(9)]
+                if teacher not in class_teachers or subject not in teacher_subjects[teacher]:
+                    model.Add(sum(x[key] for key in keys) == 0)
+                    pinned.update(keys)
+
+    # 班级课时数
+    for class_ in class_list:
+        for subject in subject_list:
+            model.Add(sum(x[teacher, class_, day, period, subject] for teacher in teacher_list
+                          for day in range(6) for period in range(9)) == subjects_required[class_].get(subject, 0))
+
+    # 教师、班级同一时段至多一节
+    for day in range(6):
+        for period in range(9):
+            for teacher in teacher_list:
+                model.Add(sum(x[teacher, class_, day, period, subject]
+                              for class_ in class_list for subject in subject_list) <= 1)
+            for class_ in class_list:
+                model.Add(sum(x[teacher, class_, day, period, subject]
+                              for teacher in teacher_list for subject in subject_list) <= 1)
+
+    # 体育课只能排在周四至周六，且不能排在上午前两节
+    if '体育' in subject_list:
+        for teacher in teacher_list:
+            for class_ in class_list:
+                for day in range(6):
+                    for period in range(9):
+                        if day < 3 or period < 2:
+                            model.Add(x[teacher, class_, day, period, '体育'] == 0)
+                            pinned.add((teacher, class_, day, period, '体育'))
+
+    # 第一节、第二节和第六节必须排课
+    for class_ in class_list:
+        for day in range(6):
+            for period in [0, 1, 5]:
+                model.Add(sum(x[teacher, class_, day, period, subject]
+                              for teacher in teacher_list for subject in subject_list) == 1)
+
+    # 课时数大于 6 的课程每天 1-2 节，否则每天最多 1 节
+    for class_ in class_list:
+        for subject in subject_list:
+            for day in range(6):
+                lesson_count = sum(x[teacher, class_, day, period, subject]
+                                   for teacher in teacher_list for period in range(9))
+                if subjects_required[class_].get(subject, 0) > 6:
+                    model.Add(lesson_count >= 1)
+                    model.Add(lesson_count <= 2)
+                else:
+                    model.Add(lesson_count <= 1)
+
+    # 当天两节课必须连堂，且不能是第五节和第六节
+    for teacher in teacher_list:
+        for class_ in class_list:
+            for day in range(6):
+                for subject in subject_list:
+                    total = sum(x[teacher, class_, day, period, subject] for period in range(9))
+                    model.Add(sum(consecutive[teacher, class_, day, period, subject] for period in range(8))
+                              >= total - 1)
+                    for period in range(8):
+                        first = x[teacher, class_, day, period, subject]
+                        second = x[teacher, class_, day, period + 1, subject]
+                        link = consecutive[teacher, class_, day, period, subject]
+                        model.AddBoolAnd([first, second]).OnlyEnforceIf(link)
+                        model.AddBoolOr([first.Not(), second.Not()]).OnlyEnforceIf(link.Not())
+                    model.Add(x[teacher, class_, day, 4, subject] + x[teacher, class_, day, 5, subject] <= 1)
+
+    # 教师当天的课程尽量全部在上午或全部在下午
+    time_block_penalties = []
+    for teacher in teacher_list:
+        for day in range(6):
+            halves = []
+            for periods in (range(5), range(5, 9)):
+                lessons = [x[teacher, class_, day, period, subject]
+                           for period in periods for class_ in class_list for subject in subject_list]
+                busy = model.NewBoolVar('')
+                model.AddBoolOr(lessons).OnlyEnforceIf(busy)
+                model.AddBoolAnd([lesson.Not() for lesson in lessons]).OnlyEnforceIf(busy.Not())
+                halves.append(busy)
+            penalty = model.NewBoolVar('')
+            model.AddBoolAnd(halves).OnlyEnforceIf(penalty)
+            model.AddBoolOr([half.Not() for half in halves]).OnlyEnforceIf(penalty.Not())
+            time_block_penalties.append(penalty)
+
+    # 周1、3、5语文尽量靠前，周2、4、6英语尽量靠前
+    subject_time_costs = []
+    for class_ in class_list:
+        for day in range(6):
+            subject = '语文' if day in [0, 2, 4] else '英语'
+            if subject not in subject_list:
+                continue
+            for period in range(9):
+                for teacher in teacher_list:
+                    cost = model.NewIntVar(0, period, '')
+                    model.Add(cost == period).OnlyEnforceIf(x[teacher, class_, day, period, subject])
+                    model.Add(cost == 0).OnlyEnforceIf(x[teacher, class_, day, period, subject].Not())
+                    subject_time_costs.append(cost)
+
+    # 尽量避免在周六排连堂
+    saturday_penalties = []
+    for class_ in class_list:
+        for subject in subject_list:
+            saturday = sum(x[teacher, class_, 5, period, subject] for teacher in teacher_list for period in range(9))
+            penalty = model.NewBoolVar('')
+            model.Add(saturday >= 2).OnlyEnforceIf(penalty)
+            model.Add(saturday < 2).OnlyEnforceIf(penalty.Not())
+            saturday_penalties.append(penalty)
+
+    model.Minimize(sum(time_block_penalties) + sum(subject_time_costs) * 100 + sum(saturday_penalties) * 10)
+    return model, x, pinned
+
+
+def solve_fixed(model, x, courses):
+    """把稠密模型的决策变量固定为课表 courses，返回求解状态和目标值"""
+    scheduled = {(course['teacher_name'], course['class'], course['week'], course['sort'], course['subject'])
+                 for course in courses}
+    fixed = model.clone()
+    for key, var in x.items():
+        fixed.Add(var == (1 if key in scheduled else 0))
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = 300
+    status = solver.Solve(fixed)
+    objective = solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None
+    return status, objective
+
+
+@pytest.fixture(scope='module')
+def problem():
+    problem = load_problem(DATA, cache_dir=None)
+    return {key: problem[key] for key in
+            ['teacher_subjects', 'subjects_required', 'teacher_required', 'confirm_courses', 'no_courses']}
+
+
+@pytest.fixture(scope='module')
+def dense(problem):
+    return build_dense_model(**problem)
+
+
+@pytest.fixture(scope='module')
+def sparse(problem):
+    return build_model(**problem)
+
+
+@pytest.fixture(scope='module')
+def timetable(problem):
+    status, courses = feasible_timetable(**problem, time_limit=120)
+    assert courses is not None
+    return courses
+
+
+def test_sparse_variables_are_the_unpinned_dense_variables(dense, sparse):
+    _, x, pinned = dense
+    _, index = sparse
+    assert set(index.x) == set(x) - pinned
+
+
+def test_same_objective_on_feasible_timetable(dense, sparse, timetable):
+    sparse_model, index = sparse
+    objective = evaluate(sparse_model, index, timetable)
+    assert objective is not None
+
+    status, dense_objective = solve_fixed(dense[0], dense[1], timetable)
+    assert status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+    assert dense_objective == objective
+
+
+def test_same_constraints_reject_invalid_timetable(dense, sparse, timetable):
+    # 去掉一节课：课时数不满足，两个模型都无解
+    broken = timetable[1:]
+    sparse_model, index = sparse
+    assert evaluate(sparse_model, index, broken) is None
+    status, _ = solve_fixed(dense[0], dense[1], broken)
+    assert status == cp_model.INFEASIBLE
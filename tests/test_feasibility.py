@@ -0,0 +1,39 @@
+"""check_feasibility() 对预排时段类型的检查"""
+import os
+
+import numpy as np
+import pytest
+
+from feasibility import check_feasibility
+from loader import load_problem
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'data.xlsx')
+INPUT_KEYS = ['teacher_subjects', 'subjects_required', 'teacher_required', 'confirm_courses', 'no_courses']
+
+
+@pytest.fixture(scope='module')
+def problem():
+    problem = load_problem(DATA, cache_dir=None)
+    return {key: problem[key] for key in INPUT_KEYS}
+
+
+def with_confirm_slots(problem, convert):
+    confirm_courses = [{**course, 'week': convert(course['week']), 'sort': convert(course['sort'])}
+                       for course in problem['confirm_courses']]
+    return {**problem, 'confirm_courses': confirm_courses}
+
+
+def test_data_passes(problem):
+    assert problem['confirm_courses']
+    assert check_feasibility(**problem) == []
+
+
+@pytest.mark.parametrize('convert', [np.int64, np.int32, int])
+def test_numpy_integer_slots_are_accepted(problem, convert):
+    assert check_feasibility(**with_confirm_slots(problem, convert)) == []
+
+
+@pytest.mark.parametrize('convert', [float, str, lambda value: bool(value), lambda value: value + 9])
+def test_invalid_slots_are_rejected(problem, convert):
+    errors = check_feasibility(**with_confirm_slots(problem, convert))
+    assert any("时段超出 6 天 × 9 节" in error for error in errors)
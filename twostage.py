@@ -0,0 +1,199 @@
+import time
+from collections import defaultdict
+
+from ortools.sat.python import cp_model
+
+from export import check_formats, course_key, export_timetable
+from lns import lns
+from rules import DEFAULT_RULES, allowed_slots, enabled_rules, find_rule, time_grid
+from telemetry import SolveMonitor, Telemetry
+from TimeTable import add_hints, build_model, solve_model
+
+
+def build_slot_model(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+                     rules=None):
+    """第一阶段的无教师模型，返回模型和 {(class, day, period, subject): [覆盖该时段的课块变量]}
+
+    每个班级每门课程的教师取 teacher_required 中的任课教师，教师冲突由此推出，变量不再带教师维度。
+    每天的课程用“课块”表示：单节，或课时数大于 daily_hours 阈值的课程的连堂两节（不跨 double_lesson 的 split），
+    每门课每天至多一个课块，连堂和每天节数的规则由此直接成立，不需要 build_model() 中的连堂辅助变量。
+    规则集中没有 daily_hours 或 double_lesson 规则时无法这样表示，返回 (None, None)。
+    """
+    rules = rules or DEFAULT_RULES
+    days, periods = time_grid(rules)
+    daily_hours = find_rule(rules, 'daily_hours')
+    double_lesson = find_rule(rules, 'double_lesson')
+    mandatory = find_rule(rules, 'mandatory_periods')
+    if daily_hours is None or double_lesson is None:
+        return None, None
+    split = tuple(double_lesson['split'])
+    no_course_keys = {course_key(course) for course in no_courses}
+
+    model = cp_model.CpModel()
+    cover = defaultdict(list)
+    class_slot = defaultdict(list)
+    teacher_slot = defaultdict(list)
+    for class_, required in subjects_required.items():
+        for subject, hours in required.items():
+            teacher = teacher_required.get(class_, {}).get(subject)
+            if hours <= 0:
+                continue
+            if subject not in teacher_subjects.get(teacher, []):
+                # 没有任课教师，模型无解
+                model.AddBoolOr([])
+                continue
+            allowed = {(day, period) for day, period in allowed_slots(rules, subject)
+                       if (teacher, class_, day, period, subject) not in no_course_keys}
+            daily = hours > daily_hours['threshold']
+            hour_terms = []
+            hour_counts = []
+            for day in range(days):
+                blocks = []
+                for period in range(periods):
+                    if (day, period) not in allowed:
+                        continue
+                    single = model.NewBoolVar('')
+                    blocks.append(single)
+                    hour_terms.append(single)
+                    hour_counts.append(1)
+                    cover[class_, day, period, subject].append(single)
+                    if daily and (day, period + 1) in allowed and (period, period + 1) != split:
+                        double = model.NewBoolVar('')
+                        blocks.append(double)
+                        hour_terms.append(double)
+                        hour_counts.append(2)
+                        cover[class_, day, period, subject].append(double)
+                        cover[class_, day, period + 1, subject].append(double)
+                # 课时数大于阈值的课程每天恰好一个课块（1-2 节），否则每天至多一节
+                if daily:
+                    model.AddExactlyOne(blocks)
+                else:
+                    model.AddAtMostOne(blocks)
+            model.Add(cp_model.LinearExpr.WeightedSum(hour_terms, hour_counts) == hours)
+            for day, period in allowed:
+                if (class_, day, period, subject) in cover:
+                    class_slot[class_, day, period].extend(cover[class_, day, period, subject])
+                    teacher_slot[teacher, day, period].extend(cover[class_, day, period, subject])
+
+    # 班级、教师同一时段至多一节课，必排时段恰好一节
+    mandatory_periods = set(mandatory['periods']) if mandatory else set()
+    for (class_, day, period), blocks in class_slot.items():
+        if period not in mandatory_periods:
+            model.AddAtMostOne(blocks)
+    for class_ in subjects_required:
+        for day in range(days):
+            for period in mandatory_periods:
+                if period < periods:
+                    model.AddExactlyOne(class_slot.get((class_, day, period), []))
+    for blocks in teacher_slot.values():
+        if len(blocks) > 1:
+            model.AddAtMostOne(blocks)
+
+    # 预排
+    for course in confirm_courses:
+        blocks = cover.get((course.get('class'), course.get('week'), course.get('sort'), course.get('subject')))
+        teacher = teacher_required.get(course.get('class'), {}).get(course.get('subject'))
+        if blocks and course.get('teacher_name') == teacher:
+            model.AddBoolOr(blocks)
+        else:
+            model.AddBoolOr([])
+    return model, cover
+
+
+def feasible_timetable(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+                       time_limit=60, workers=0, rules=None, telemetry=None, stop_policy=None):
+    """第一阶段：只满足硬约束，尽快得到一个可行课表，返回求解状态和课程列表（无解时为 None）
+
+    优先使用 build_slot_model() 的无教师课块模型；规则集无法用课块表示时，
+    改用 build_model() 并把软约束的权重全部置为 0，不建时间块等辅助变量，也没有目标函数。
+    两种模型都没有目标函数，CP-SAT 找到第一个可行解即停止。
+    telemetry、stop_policy 见 solve_model()，例如用 stop_policy 在找到可行解之前取消求解。
+    """
+    rules = rules or DEFAULT_RULES
+    solver = cp_model.CpSolver()
+    solver.parameters.num_search_workers = workers
+    model, cover = build_slot_model(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses,
+                                    rules)
+    if model is None:
+        model, index = build_model(teacher_subjects, subjects_required, teacher_required, confirm_courses, no_courses,
+                                   weights={rule['name']: 0 for rule in enabled_rules(rules, 'soft')}, rules=rules)
+        return solve_model(model, index, time_limit, solver=solver, telemetry=telemetry, stop_policy=stop_policy)
+
+    solver.parameters.max_time_in_seconds = time_limit
+    if telemetry is not None or stop_policy is not None:
+        status = SolveMonitor(telemetry or Telemetry(), stop_policy).solve(solver, model)
+    else:
+        status = solver.Solve(model)
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        return status, None
+    courses = []
+    for (class_, day, period, subject), blocks in cover.items():
+        if any(solver.BooleanValue(block) for block in blocks):
+            courses.append({'class': class_, 'teacher_name': teacher_required[class_][subject], 'subject': subject,
+                            'week': day, 'sort': period})
+    return status, courses
+
+
+def evaluate(model, index, courses):
+    """课表 courses 在模型 model 上的目标值：固定全部决策变量后求解，课表违反约束时返回 None"""
+    scheduled = {course_key(course) for course in courses}
+    fixed = model.clone()
+    for key, course in index.x.items():
+        fixed.Add(course == (1 if key in scheduled else 0))
+    solver = cp_model.CpSolver()
+    status = solver.Solve(fixed)
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        return None
+    return solver.ObjectiveValue()
+
+
+def two_stage(teacher_subjects, subjects_required, teacher_required={}, confirm_courses=[], no_courses=[],
+              stage1_time_limit=60, time_limit=600, workers=0, stage2='hint', rules=None, weights=None,
+              stop_policy=None, output_dir='.', formats=('excel',)):
+    """两阶段排课：先用 feasible_timetable() 得到可行课表，再以它为起点优化软约束
+
+    stage2 为 'hint' 时把第一阶段的课表作为提示求解完整模型，为 'lns' 时作为大邻域搜索的初始解；
+    time_limit 为两个阶段的总时间，stop_policy 为第二阶段（hint）的提前停止策略，见 solve_model()。
+    返回最好的课程列表和记录 [(耗时, 目标值, 阶段)]，并按 formats 导出到 output_dir；第一阶段无解时课程列表为 None。
+    """
+    check_formats(formats)
+    inputs = {
+        'teacher_subjects': teacher_subjects,
+        'subjects_required': subjects_required,
+        'teacher_required': teacher_required,
+        'confirm_courses': confirm_courses,
+        'no_courses': no_courses,
+    }
+    start = time.perf_counter()
+    log = []
+
+    status, courses = feasible_timetable(**inputs, time_limit=min(stage1_time_limit, time_limit), workers=workers,
+                                         rules=rules)
+    if courses is None:
+        return None, log
+    stage1_seconds = round(time.perf_counter() - start, 3)
+    remaining = max(time_limit - (time.perf_counter() - start), 1)
+
+    if stage2 == 'lns':
+        best, lns_log = lns(**inputs, initial=courses, time_limit=remaining, workers=workers or None, rules=rules,
+                            weights=weights, output_dir=output_dir, formats=formats)
+        log.append((stage1_seconds, lns_log[0][1] if lns_log else None, "第一阶段"))
+        log.extend((round(stage1_seconds + elapsed, 3), objective, f"第二阶段 {name}")
+                   for elapsed, objective, name in lns_log[1:])
+        return best or courses, log
+
+    # 第二阶段的每个改进解都记入 log
+    model, index = build_model(**inputs, weights=weights, rules=rules)
+    log.append((stage1_seconds, evaluate(model, index, courses), "第一阶段"))
+    solutions = []
+    telemetry = Telemetry(lambda record: solutions.append((round(time.perf_counter() - start, 3), record['objective']))
+                          if record['event'] == 'solution' else None)
+    add_hints(model, index, courses)
+    solver = cp_model.CpSolver()
+    solver.parameters.num_search_workers = workers
+    status, best = solve_model(model, index, remaining, solver=solver, telemetry=telemetry, stop_policy=stop_policy)
+    log.extend((elapsed, objective, "第二阶段") for elapsed, objective in solutions)
+    if best is None:
+        best = courses
+    export_timetable(best, list(subjects_required.keys()), list(teacher_subjects.keys()), output_dir, formats)
+    return best, log